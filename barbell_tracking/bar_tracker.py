@@ -0,0 +1,120 @@
+'''
+This script is used by the contour_track_21.py script to predict where the barbell will be in the next frame.
+
+A constant velocity Kalman filter is kept on the centre of the barbell, the prediction and its uncertainty are used
+to gate which contours can be the barbell, contours far away from the prediction are never looked at and so a stray
+blue contour can not corrupt the tracked position. The confidence of each frame's match is kept for reporting.
+'''
+
+import numpy as np
+
+
+class BarTracker:
+    def __init__(self, process_noise=4.0, measurement_noise=3.0, gate=3.5, max_missed_frames=15):
+        # state is x, y, x velocity, y velocity in pixels and pixels per frame
+        self.state = None
+        self.covariance = None
+        self.transition = np.array([[1, 0, 1, 0],
+                                    [0, 1, 0, 1],
+                                    [0, 0, 1, 0],
+                                    [0, 0, 0, 1]], dtype=float)
+        self.observation = np.array([[1, 0, 0, 0],
+                                     [0, 1, 0, 0]], dtype=float)
+        # white noise acceleration model for a step of one frame
+        self.process_noise = process_noise ** 2 * np.array([[0.25, 0, 0.5, 0],
+                                                            [0, 0.25, 0, 0.5],
+                                                            [0.5, 0, 1, 0],
+                                                            [0, 0.5, 0, 1]])
+        self.measurement_noise = measurement_noise ** 2 * np.eye(2)
+        self.gate = gate # contours further than this many standard deviations from the prediction are ignored
+        self.max_missed_frames = max_missed_frames # frames without a match before the track is dropped
+        self.missed_frames = 0
+        self.innovation_covariance = None
+        self.confidence = 0.0 # confidence of the most recent frame, 0 when the bar was not found
+
+    @property
+    def is_tracking(self):
+        return self.state is not None
+
+    def start(self, x, y):
+        '''
+        Starts a new track at the given centre with an unknown velocity
+        '''
+        self.state = np.array([x, y, 0, 0], dtype=float)
+        self.covariance = np.diag([self.measurement_noise[0, 0], self.measurement_noise[1, 1], 100.0, 100.0])
+        self.innovation_covariance = None
+        self.missed_frames = 0
+        self.confidence = 1.0
+
+    def reset(self):
+        self.state = None
+        self.covariance = None
+        self.innovation_covariance = None
+        self.missed_frames = 0
+        self.confidence = 0.0
+
+    def predict(self):
+        '''
+        Moves the track on by one frame, returns the predicted centre and the 2x2 covariance of where the
+        barbell is expected to be found, None if there is no track
+        '''
+        if self.state is None:
+            return None
+
+        self.state = self.transition @ self.state
+        self.covariance = self.transition @ self.covariance @ self.transition.T + self.process_noise
+        self.innovation_covariance = self.observation @ self.covariance @ self.observation.T + self.measurement_noise
+        return self.predicted_centre(), self.innovation_covariance
+
+    def predicted_centre(self):
+        return int(round(self.state[0])), int(round(self.state[1]))
+
+    def search_radius(self):
+        '''
+        Returns the x and y distance from the prediction that is still inside the gate
+        '''
+        return (self.gate * np.sqrt(self.innovation_covariance[0, 0]),
+                self.gate * np.sqrt(self.innovation_covariance[1, 1]))
+
+    def mahalanobis_sq(self, centres):
+        '''
+        Squared distance in standard deviations between the prediction and every centre in a (n, 2) array
+        '''
+        differences = np.asarray(centres, dtype=float) - self.state[:2]
+        inverse = np.linalg.inv(self.innovation_covariance)
+        return np.einsum('ij,jk,ik->i', differences, inverse, differences)
+
+    def select(self, centres):
+        '''
+        Returns the index of the centre that best matches the prediction and is inside the gate, None if none are
+        '''
+        if len(centres) == 0:
+            return None
+
+        distances = self.mahalanobis_sq(centres)
+        best = int(np.argmin(distances))
+        if distances[best] > self.gate ** 2:
+            return None
+        return best
+
+    def update(self, x, y):
+        '''
+        Corrects the track with the matched centre, the confidence is the likelihood of the match
+        relative to a perfect match, 1 at the prediction and exp(-gate² / 2) at the edge of the gate
+        '''
+        innovation = np.array([x, y], dtype=float) - self.observation @ self.state
+        inverse = np.linalg.inv(self.innovation_covariance)
+        gain = self.covariance @ self.observation.T @ inverse
+        self.state = self.state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ self.observation) @ self.covariance
+        self.confidence = float(np.exp(-0.5 * innovation @ inverse @ innovation))
+        self.missed_frames = 0
+
+    def miss(self):
+        '''
+        No contour matched the prediction this frame, the track is dropped after too many misses
+        '''
+        self.confidence = 0.0
+        self.missed_frames += 1
+        if self.missed_frames > self.max_missed_frames:
+            self.reset()
@@ -0,0 +1,74 @@
+'''
+Micro-benchmark of the colour mask methods in colour_mask.py on 720p frames.
+
+Compares the original per-frame cvtColor + inRange (new HSV image and mask every call) with the preallocated
+'hsv' method and the 'lut' method at a few table sizes, and checks how many pixels each mask differs from the
+original by.
+
+Usage: python barbell_tracking/benchmark_colour_mask.py [video_path]
+Without a video a synthetic frame with light-blue squares over noise is used.
+'''
+
+import sys
+import time
+import cv2
+import numpy as np
+from colour_mask import BarColourMask, colour_lookup_table
+
+LOWER_BLUE = np.array([90, 120, 120])
+UPPER_BLUE = np.array([100, 255, 255])
+
+
+def synthetic_frame(width=1280, height=720, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    blue = cv2.cvtColor(np.uint8([[[95, 200, 200]]]), cv2.COLOR_HSV2BGR)[0, 0].tolist()
+    for x, y in ((300, 200), (700, 400), (1000, 150)):
+        cv2.rectangle(frame, (x - 25, y - 25), (x + 25, y + 25), blue, -1)
+    return frame
+
+
+def first_frame(video_path):
+    cap = cv2.VideoCapture(video_path)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        raise ValueError(f"Failed to read {video_path}")
+    return cv2.resize(frame, (1280, 720), interpolation=cv2.INTER_AREA)
+
+
+def original_mask(frame):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    return cv2.inRange(hsv, LOWER_BLUE, UPPER_BLUE)
+
+
+def time_per_frame_ms(function, frame, repeats=200):
+    function(frame)  # warm up, allocates the reused buffers
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(frame)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    frame = first_frame(sys.argv[1]) if len(sys.argv) > 1 else synthetic_frame()
+    reference = original_mask(frame)
+
+    methods = [('original cvtColor + inRange', original_mask),
+               ('preallocated hsv', BarColourMask(LOWER_BLUE, UPPER_BLUE, 'hsv').apply)]
+    for bits in (5, 6, 8):
+        build_start = time.perf_counter()
+        colour_lookup_table(LOWER_BLUE, UPPER_BLUE, bits)
+        build_ms = (time.perf_counter() - build_start) * 1000
+        methods.append((f'lut {bits} bits (table built in {build_ms:.0f} ms)',
+                        BarColourMask(LOWER_BLUE, UPPER_BLUE, 'lut', bits).apply))
+
+    print(f"frame {frame.shape[1]}x{frame.shape[0]}")
+    for name, function in methods:
+        ms = time_per_frame_ms(function, frame)
+        differing = int(np.count_nonzero(function(frame) != reference))
+        print(f"{name:45s} {ms:7.3f} ms/frame  {differing:8d} pixels differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+'''
+This script fuses the left (L) and right (R) camera recordings of the same set into one speed per repetition.
+
+Each camera on its own gives its own row of speeds, which do not always agree and do not always count the same reps.
+Here the two recordings of a set are paired by their filenames (camera_session_set), both videos are decoded and
+tracked at the same time on two threads (OpenCV releases the GIL while decoding and masking), and:
+
+- the two trajectories are aligned in time, the cameras are not started at the same moment, by cross-correlating
+  their vertical bar velocity (both are in metres per second thanks to the barbell radius calibration),
+- the two velocity series are merged onto the right camera's timeline, averaging where both cameras see the bar,
+- the reps counted on each camera are matched by their aligned top times and merged into one speed per rep,
+  weighted by the tracking confidence of each camera, with a confidence score for the fused speed.
+
+The offset search covers --max-lag seconds either way (10 by default). A best offset on the edge of the search, or
+one hardly better than the next best peak (the reps of a set look alike, so a neighbouring rep can line up too), or
+one that leaves reps of both cameras unmatched, is not trusted: the two cameras are then written separately,
+Camera L and R, with a low confidence.
+
+The confidence is the product of how well the two speeds agree (1 - relative difference), how well the two
+trajectories line up (peak correlation) and the tracking confidence. A rep seen by only one camera keeps that
+camera's speed with half its tracking confidence.
+
+The fused reps are written as a rep table (see rep_table.py) with Camera 'LR' and the per camera speeds, the
+confidence and the time offset as extra columns, so it can be given to model_registry.py like any rep table.
+
+Usage: python barbell_tracking/camera_fusion.py --videos ./videos --output fused_rep_table.npz
+       python barbell_tracking/camera_fusion.py --trajectories trajectories/   (no decoding, uses stored trajectories)
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import contour_track_21 as vp
+from rep_analysis import bar_centres, find_reps
+from rep_table import REP_TABLE_COLUMNS, save_table
+from trajectory import load_trajectory
+from video_analysis_factory import find_videos
+
+FUSED_COLUMNS = REP_TABLE_COLUMNS + ['SpeedL', 'SpeedR', 'Confidence', 'OffsetS']
+AMBIGUOUS_PEAK_RATIO = 0.9  # a second correlation peak at least this close to the best makes the offset ambiguous
+UNALIGNED_CONFIDENCE = 0.25  # confidence scale of the per camera reps of a pair that could not be aligned
+
+
+def set_key(filename):
+    '''
+    (session, set label) of a camera_session_set filename, None if the filename has less than 3 parts
+    '''
+    parts = os.path.splitext(filename)[0].split('_')
+    if len(parts) < 3:
+        return None
+    return parts[1], parts[2]
+
+
+def pair_recordings(recordings):
+    '''
+    Pairs the left and right recordings of each set.
+    recordings are (day, filename, path) tuples, returns {(day, session, set label): {'L': path, 'R': path}},
+    a set filmed by one camera only has one entry
+    '''
+    pairs = {}
+    for day, filename, path in recordings:
+        key = set_key(filename)
+        camera = filename.split('_')[0]
+        if key is None or camera not in ('L', 'R'):
+            continue
+        pairs.setdefault((day, *key), {})[camera] = path
+    return dict(sorted(pairs.items()))
+
+
+def track_video(source, right, **processor_options):
+    '''
+    Runs a headless VideoProcessor recording its trajectory, returns the trajectory arrays
+    '''
+    processor = vp.VideoProcessor(source, right, headless=True, record_trajectory=True, **processor_options)
+    processor.run()
+    return processor.trajectory_arrays()
+
+
+def track_pair(sources, **processor_options):
+    '''
+    Tracks the recordings of one set, {'L': source, 'R': source}, both cameras are decoded at the same time
+    '''
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        futures = {camera: executor.submit(track_video, source, camera == 'R', **processor_options)
+                   for camera, source in sources.items()}
+        return {camera: future.result() for camera, future in futures.items()}
+
+
+def height_series(trajectory):
+    '''
+    (timestamps, bar height in metres) of the trajectory, one row per frame, upwards positive
+    '''
+    timestamps, first_rows = np.unique(trajectory['timestamp_s'], return_index=True)
+    _, y = bar_centres(trajectory)
+    start_w, start_h = trajectory['start_box'][2:]
+    mmpp = trajectory['barbell_radius_mm'] / (min(start_w, start_h) // 2)
+    return timestamps, -y[first_rows] * mmpp / 1000
+
+
+def velocity_on_grid(trajectory, grid_s, offset_s=0.0):
+    '''
+    Vertical bar velocity in m/s at the grid times, NaN where the camera did not see the bar.
+    offset_s moves the trajectory onto the grid's timeline.
+    '''
+    timestamps, height = height_series(trajectory)
+    velocity = np.full(len(grid_s), np.nan)
+    if len(timestamps) < 2:
+        return velocity
+    timestamps = timestamps + offset_s
+    seen = (grid_s >= timestamps[0]) & (grid_s <= timestamps[-1])
+    heights = np.interp(grid_s[seen], timestamps, height)
+    if np.count_nonzero(seen) > 1:
+        velocity[seen] = np.gradient(heights, grid_s[seen])
+    return velocity
+
+
+def estimate_offset(left, right, max_lag_s=10.0, step_s=None):
+    '''
+    Seconds to add to the left camera's timestamps to put them on the right camera's timeline, and the peak
+    correlation of the two velocity series (1 is a perfect match).
+    The correlation is normalised by the whole of both series, so an offset that only lines up some of the reps
+    scores lower than one that lines up all of them. The correlation is 0 when the offset can not be trusted:
+    the best peak is on the edge of the search (the true offset may be further out) or a second peak comes close.
+    '''
+    step_s = step_s or 1 / right['fps']
+    left_t, _ = height_series(left)
+    right_t, _ = height_series(right)
+    if len(left_t) < 2 or len(right_t) < 2:
+        return 0.0, 0.0
+    left_grid = np.arange(left_t[0], left_t[-1], step_s)
+    right_grid = np.arange(right_t[0], right_t[-1], step_s)
+    left_v = np.nan_to_num(velocity_on_grid(left, left_grid))
+    right_v = np.nan_to_num(velocity_on_grid(right, right_grid))
+
+    # lag in grid steps between the first grid times, the search is centred on no offset between the videos
+    base = int(round((right_grid[0] - left_grid[0]) / step_s)) if len(right_grid) and len(left_grid) else 0
+    max_lag = int(round(max_lag_s / step_s))
+    norm = np.sqrt(np.dot(left_v, left_v) * np.dot(right_v, right_v))
+    if norm == 0:
+        return 0.0, 0.0
+    lags = np.arange(-max_lag, max_lag + 1)
+    scores = np.zeros(len(lags))
+    for i, lag in enumerate(lags):
+        # left sample i lines up with right sample i - (base + lag)
+        shift = base + lag
+        start = max(shift, 0)
+        stop = min(len(left_v), len(right_v) + shift)
+        if stop - start < 2:
+            continue
+        scores[i] = np.dot(left_v[start:stop], right_v[start - shift:stop - shift]) / norm
+
+    best = int(np.argmax(scores))
+    best_score = float(scores[best])
+    if best_score <= 0 or best in (0, len(lags) - 1):
+        return 0.0, 0.0
+    # the other local peaks, a rep period or more away from the best one
+    peaks = np.flatnonzero((scores[1:-1] > scores[:-2]) & (scores[1:-1] >= scores[2:])) + 1
+    others = scores[peaks[peaks != best]]
+    if len(others) and others.max() >= AMBIGUOUS_PEAK_RATIO * best_score:
+        return 0.0, 0.0
+    return -int(lags[best]) * step_s, best_score
+
+
+def fused_velocity(left, right, offset_s, step_s=None):
+    '''
+    One velocity series on the right camera's timeline: the mean of both cameras where both see the bar, otherwise the
+    camera that does. Returns (times, velocity, agreement), agreement is 1 - the relative difference of the two
+    cameras and NaN where only one camera sees the bar
+    '''
+    step_s = step_s or 1 / right['fps']
+    left_t, _ = height_series(left)
+    right_t, _ = height_series(right)
+    times = [t for t in (left_t + offset_s, right_t) if len(t)]
+    if not times:
+        return np.empty(0), np.empty(0), np.empty(0)
+    grid = np.arange(min(t[0] for t in times), max(t[-1] for t in times) + step_s / 2, step_s)
+    left_v = velocity_on_grid(left, grid, offset_s)
+    right_v = velocity_on_grid(right, grid)
+    velocity = np.nanmean(np.vstack((left_v, right_v)), axis=0) if len(grid) else grid
+    both = ~np.isnan(left_v) & ~np.isnan(right_v)
+    agreement = np.full(len(grid), np.nan)
+    scale = np.maximum(np.abs(left_v[both]), np.abs(right_v[both]))
+    agreement[both] = 1 - np.abs(left_v[both] - right_v[both]) / np.where(scale > 0, scale, 1)
+    return grid, velocity, np.clip(agreement, 0, 1)
+
+
+def rep_confidence(trajectory, rep):
+    '''
+    Mean tracking confidence of the rows of the rep's concentric phase
+    '''
+    return float(np.mean(trajectory['confidence'][rep['bottom_row']:rep['top_row'] + 1]))
+
+
+def fuse_reps(left, right, offset_s, alignment=1.0, tolerance_s=0.5):
+    '''
+    Matches the reps counted on each camera by the aligned time of their top and merges each pair into one speed.
+    Returns one dictionary per rep, in time order, with the fused speed, both cameras' speeds (NaN when a camera
+    missed the rep) and the confidence of the fused speed
+    '''
+    tops = []
+    for camera, trajectory, shift in (('L', left, offset_s), ('R', right, 0.0)):
+        if trajectory is None:
+            continue
+        for rep in find_reps(trajectory):
+            tops.append((trajectory['timestamp_s'][rep['top_row']] + shift, camera, rep['metres_per_second'],
+                         rep_confidence(trajectory, rep)))
+    tops.sort()
+
+    fused = []
+    used = set()
+    for i, (time_s, camera, speed, tracking) in enumerate(tops):
+        if i in used:
+            continue
+        # the nearest rep of the other camera within the tolerance, later in time as the list is sorted
+        match = next((j for j in range(i + 1, len(tops)) if j not in used and tops[j][1] != camera
+                      and tops[j][0] - time_s <= tolerance_s), None)
+        speeds = {'L': np.nan, 'R': np.nan}
+        speeds[camera] = speed
+        if match is None:
+            fused.append({'time_s': float(time_s), 'Speed': speed, 'SpeedL': speeds['L'], 'SpeedR': speeds['R'],
+                          'Confidence': 0.5 * tracking})
+            continue
+
+        used.add(match)
+        _, other_camera, other_speed, other_tracking = tops[match]
+        speeds[other_camera] = other_speed
+        weights = np.array([tracking, other_tracking])
+        if weights.sum() == 0:
+            weights = np.ones(2)
+        speed_fused = float(np.average([speed, other_speed], weights=weights))
+        scale = max(abs(speed), abs(other_speed))
+        agreement = 1 - abs(speed - other_speed) / scale if scale > 0 else 1.0
+        confidence = max(agreement, 0.0) * max(alignment, 0.0) * float(weights.mean())
+        fused.append({'time_s': float(time_s), 'Speed': speed_fused, 'SpeedL': speeds['L'], 'SpeedR': speeds['R'],
+                      'Confidence': confidence})
+    return fused
+
+
+def camera_reps(trajectory, confidence_scale):
+    '''
+    The reps of one camera on their own, in the form fuse_reps returns
+    '''
+    speed_column = 'SpeedR' if trajectory['right'] else 'SpeedL'
+    return [{'time_s': float(trajectory['timestamp_s'][rep['top_row']]), 'Speed': rep['metres_per_second'],
+             'SpeedL': np.nan, 'SpeedR': np.nan, speed_column: rep['metres_per_second'],
+             'Confidence': confidence_scale * rep_confidence(trajectory, rep)}
+            for rep in find_reps(trajectory)]
+
+
+def reps_consistent(fused):
+    '''
+    Every rep of the camera that counted fewer reps has been matched. An offset a whole rep out still correlates
+    well, but leaves a rep of each camera unmatched at either end of the set
+    '''
+    left_reps = sum(not np.isnan(rep['SpeedL']) for rep in fused)
+    right_reps = sum(not np.isnan(rep['SpeedR']) for rep in fused)
+    matched = sum(not np.isnan(rep['SpeedL']) and not np.isnan(rep['SpeedR']) for rep in fused)
+    return matched == min(left_reps, right_reps)
+
+
+def fuse_pair(day, key, sources, trajectories=None, max_lag_s=10.0, tolerance_s=0.5, series_folder=None,
+              **processor_options):
+    '''
+    Worker function, fuses the recordings of one set. Kept at module level so it can be sent to the worker processes.
+    sources are {'L': source, 'R': source}, when trajectories are given they are used instead of decoding the videos.
+    Returns the rows of the fused rep table.
+    '''
+    session, set_label = key
+    if trajectories is None:
+        trajectories = track_pair(sources, **processor_options)
+    left, right = trajectories.get('L'), trajectories.get('R')
+
+    offset_s, alignment = 0.0, 0.0
+    if left is not None and right is not None:
+        offset_s, alignment = estimate_offset(left, right, max_lag_s)
+        if series_folder is not None:
+            times, velocity, agreement = fused_velocity(left, right, offset_s)
+            np.savez_compressed(os.path.join(series_folder, f'{session}_{set_label}.npz'), timestamp_s=times,
+                                velocity=velocity, agreement=agreement, offset_s=np.float64(offset_s))
+
+    fused = fuse_reps(left, right, offset_s, alignment, tolerance_s)
+    if left is not None and right is not None and (alignment == 0 or not reps_consistent(fused)):
+        # the cameras could not be lined up, matching their reps would pair the wrong ones
+        outputs = [(camera, sources[camera], camera_reps(trajectories[camera], UNALIGNED_CONFIDENCE))
+                   for camera in ('L', 'R')]
+    else:
+        outputs = [('LR', sources.get('R', sources.get('L')), fused)]
+
+    rows = []
+    for camera, source, reps in outputs:
+        filename = os.path.basename(str(source))
+        for rep_number, rep in enumerate(reps, start=1):
+            rows.append({'Camera': camera, 'SessionNumber': int(session), 'SetNumber': int(set_label[0:2]),
+                         'SetLabel': set_label, 'Filename': filename, 'Rep': rep_number, 'Speed': rep['Speed'],
+                         'SpeedL': rep['SpeedL'], 'SpeedR': rep['SpeedR'], 'Confidence': rep['Confidence'],
+                         'OffsetS': offset_s})
+    return day, key, rows
+
+
+def find_trajectories(folder):
+    '''
+    (day, filename, path) of every stored trajectory, the day is not known from a trajectory file and is left as None
+    '''
+    return [(None, filename, os.path.join(folder, filename)) for filename in sorted(os.listdir(folder))
+            if filename.endswith('.npz')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuse the left and right camera recordings of each set into one speed per rep")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--videos', default='./videos', help="folder holding the day0..day4 video folders")
+    source.add_argument('--trajectories', default=None, help="folder of stored trajectories to fuse instead of decoding the videos")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, defaults to the number of cores")
+    parser.add_argument('--max-lag', type=float, default=10.0, help="largest time offset between the cameras searched, in seconds")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="seconds between the aligned reps of both cameras to match them")
+    parser.add_argument('--series', default=None, help="folder to save each set's fused velocity series to")
+    parser.add_argument('--tracker', action='store_true', help="gate contours with the predictive bar tracker")
+    parser.add_argument('--roi', action='store_true', help="only search a window around the last bar position")
+    parser.add_argument('--prefetch', type=int, default=0, help="decode on a separate thread with a queue of this many frames")
+    parser.add_argument('--output', default='fused_rep_table.npz', help="rep table to write, a csv copy is written next to it")
+    args = parser.parse_args()
+
+    if args.series is not None:
+        os.makedirs(args.series, exist_ok=True)
+    if args.trajectories is not None:
+        pairs = pair_recordings(find_trajectories(args.trajectories))
+    else:
+        pairs = pair_recordings(find_videos(args.videos))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for (day, *key), sources in pairs.items():
+            options = {'max_lag_s': args.max_lag, 'tolerance_s': args.tolerance, 'series_folder': args.series}
+            if args.trajectories is not None:
+                options['trajectories'] = {camera: load_trajectory(path) for camera, path in sources.items()}
+            else:
+                options.update(tracker=args.tracker, roi=args.roi, prefetch=args.prefetch)
+            futures.append(executor.submit(fuse_pair, day, tuple(key), sources, **options))
+        for future in as_completed(futures):
+            day, key, set_rows = future.result()
+            print(key, [(round(row['Speed'], 3), round(row['Confidence'], 2)) for row in set_rows])
+            rows.extend(set_rows)
+
+    fused_df = pd.DataFrame(rows, columns=FUSED_COLUMNS)
+    fused_df = fused_df.sort_values(['SessionNumber', 'SetLabel', 'Camera', 'Rep'], kind='stable').reset_index(drop=True)
+    save_table(fused_df, args.output)
+    print(f"{len(pairs)} sets, {len(fused_df)} fused reps written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
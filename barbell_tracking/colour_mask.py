@@ -0,0 +1,97 @@
+'''
+This script is used by the contour_track_21.py script to build the mask of the barbell's light-blue colour.
+
+The mask is built into buffers that are allocated once and reused for every frame (and for every window of a
+frame in roi mode, as views into the full size buffers) instead of OpenCV allocating a new HSV image and mask each
+call. Two methods are available:
+
+    'hsv' converts to HSV and thresholds with inRange, the same result as before
+    'lut' looks every BGR pixel up in a precomputed "is bar colour" table and skips the HSV conversion,
+          with lut_bits=8 the table has an entry for every colour and gives exactly the same mask as 'hsv',
+          fewer bits quantise the colours into a table small enough to stay in the cpu cache
+
+benchmark_colour_mask.py compares the methods on 720p frames.
+'''
+
+import cv2
+import numpy as np
+
+_lookup_tables = {} # tables are shared by every processor in a process, keyed on the colour range and bits
+
+
+def colour_lookup_table(lower, upper, bits=8):
+    '''
+    Returns a flat uint8 table, 255 for every quantised BGR colour whose HSV value is inside the range.
+    The index of a colour is (b >> shift) << 2 * bits | (g >> shift) << bits | (r >> shift).
+    '''
+    key = (tuple(int(v) for v in lower), tuple(int(v) for v in upper), bits)
+    if key not in _lookup_tables:
+        shift = 8 - bits
+        # the centre of each quantisation bin stands for the whole bin
+        levels = (np.arange(2 ** bits, dtype=np.uint16) << shift) + ((1 << shift) >> 1)
+        b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+        colours = np.stack((b, g, r), axis=-1).astype(np.uint8).reshape(-1, 1, 3)
+        hsv = cv2.cvtColor(colours, cv2.COLOR_BGR2HSV)
+        _lookup_tables[key] = cv2.inRange(hsv, np.asarray(lower), np.asarray(upper)).reshape(-1)
+    return _lookup_tables[key]
+
+
+class BarColourMask:
+    def __init__(self, lower, upper, method='hsv', lut_bits=8):
+        if method not in ('hsv', 'lut'):
+            raise ValueError(f"Unknown colour mask method {method}, expected 'hsv' or 'lut'")
+        self.lower = np.asarray(lower)
+        self.upper = np.asarray(upper)
+        self.method = method
+        self.lut_bits = lut_bits
+        self.lookup_table = colour_lookup_table(lower, upper, lut_bits) if method == 'lut' else None
+        self.shape = None # full size the buffers were allocated for
+        self.hsv = None
+        self.mask = None
+        self.index = None
+        self.channel = None
+
+    def allocate(self, shape):
+        '''
+        Allocates the buffers for images up to the given (height, width)
+        '''
+        height, width = shape
+        self.shape = shape
+        self.mask = np.empty((height, width), dtype=np.uint8)
+        if self.method == 'hsv':
+            self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        else:
+            self.index = np.empty((height, width), dtype=np.uint32)
+            self.channel = np.empty((height, width), dtype=np.uint32)
+
+    def apply(self, image):
+        '''
+        Returns the mask of the image, a view into the reused mask buffer that is only valid until the next call
+        '''
+        height, width = image.shape[:2]
+        if self.shape is None:
+            self.allocate((height, width))
+        elif height > self.shape[0] or width > self.shape[1]:
+            self.allocate((max(height, self.shape[0]), max(width, self.shape[1])))
+        mask = self.mask[:height, :width]
+
+        if self.method == 'hsv':
+            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=self.hsv[:height, :width])
+            return cv2.inRange(hsv, self.lower, self.upper, dst=mask)
+
+        bits = self.lut_bits
+        shift = 8 - bits
+        index = self.index[:height, :width]
+        channel = self.channel[:height, :width]
+        # index = (b >> shift) << 2 * bits | (g >> shift) << bits | (r >> shift)
+        np.copyto(index, image[..., 0])
+        np.right_shift(index, shift, out=index)
+        np.left_shift(index, bits, out=index)
+        np.copyto(channel, image[..., 1])
+        np.right_shift(channel, shift, out=channel)
+        np.bitwise_or(index, channel, out=index)
+        np.left_shift(index, bits, out=index)
+        np.copyto(channel, image[..., 2])
+        np.right_shift(channel, shift, out=channel)
+        np.bitwise_or(index, channel, out=index)
+        return np.take(self.lookup_table, index, out=mask)
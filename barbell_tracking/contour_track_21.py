@@ -1,29 +1,46 @@
+import asyncio
 import cv2
 import numpy as np
 import time
-from starting_pos import find_initial_coordinates
-from collections import deque
+from starting_pos import find_initial_coordinates_from_frames
+from bar_tracker import BarTracker
+from trajectory import save_trajectory, trajectory_arrays
+from frame_source import ThreadedFrameSource, frame_timestamp_s, open_capture
+from colour_mask import BarColourMask
+from overlay import OverlayRenderer, BackgroundVideoWriter
+from position_history import PositionHistory
+
+# bump when a change to the tracking or rep counting changes the results, cached results of older versions are redone
+TRACKER_VERSION = 2
 
 class VideoProcessor:
-    def __init__(self, video_path,right):
-        self.video_path = video_path # video path of video file
-        self.cap = cv2.VideoCapture(video_path) # opencv capture object with passed video file
-        self.start_x, self.start_y, self.start_w, self.start_h = find_initial_coordinates(video_path) # starting x, y, width & height co-ordinates of barbell
+    def __init__(self, video_path,right, headless=False, roi=False, roi_margin=60, tracker=False, record_trajectory=False, initial_frames=1, prefetch=0,
+                 mask_method='hsv', lut_bits=8, overlay=None, fps=30, on_rep=None, resize=None, start_s=0.0, archive_path=None,
+                 skip_idle=False, idle_level=25, idle_pixels=20, rack_hold_s=2.0):
+        self.video_path = video_path # video file path, stream url or pipe, camera index or an iterable of frames
+        self.cap = open_capture(video_path, fps) # opencv capture object (or the same interface) of the source
+        if start_s > 0:
+            # trim the start of the video by seeking instead of decoding the frames
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, start_s * 1000)
+        self.resize = tuple(resize) if resize is not None else None # (width, height) raw frames are downscaled to in memory
+        self.raw_frame = None # full size buffer the raw frames are decoded into when resizing
+        # writes the (downscaled) frames to a video as they are read, e.g. to keep a 720p copy of a raw video
+        self.archive = BackgroundVideoWriter(archive_path, fourcc='avc1') if archive_path is not None else None
         self.lower_blue = np.array([90, 120, 120]) # np array for lower range of light-blue colour
         self.upper_blue = np.array([100, 255, 255]) # np array for upper range of light-blue colour
+        self.colour_mask = BarColourMask(self.lower_blue, self.upper_blue, mask_method, lut_bits) # reused mask buffers, 'hsv' or 'lut'
         self.prev_y = None # previous y position
         self.prev_x = None # previous x position
-        self.y_positions = deque(maxlen=2000) # all y positions during repetition
-        self.x_positions = [] # all x positions during repetition
+        self.positions = PositionHistory(2000) # the last 2000 x & y positions with a running minimum & maximum y
         self.frame_count = 0 # number of frames during concentric phase
         self.rep_count = 0
         self.set_started = False
         self.concentric_started = False
         self.eccentric_started = False
         self.barbell_radius_mm = 50 
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or fps # cameras may not report a frame rate
         self.frame_delay_ns = int(1_000_000_000 / self.fps) # frame delay required to play back in real time
-        self.frame_width = 1280
+        self.frame_width = self.resize[0] if self.resize is not None else 1280
         self.rep_start_time_ns = None
         self.bottom_x = None
         self.bottom_y = None
@@ -34,9 +51,57 @@ class VideoProcessor:
         self.metres_per_second_list = [] # m/s variable for all reps
         self.rep_starting_pos = None
         self.set_ended = False
+        self.stopping = False # set by stop() to end the processing before the end of the source
         self.distance_check = 0
         self.right = right
         self.rep_duration_s = None
+        self.headless = headless # no GUI calls, rep timing taken from frame timestamps instead of the wall clock
+        # live sources and frame iterables are not played back at the video's own speed, time them from timestamps too
+        self.frame_timing = headless or not isinstance(video_path, str)
+        self.on_rep = on_rep # called with the rep event as soon as a rep is counted
+        self.rep_events = [] # events of the reps counted in the current frame
+        self.frame_index = -1 # index of the most recently decoded frame
+        self.frame_timestamp_s = None # presentation timestamp of the most recently decoded frame
+        self.rep_start_timestamp_s = None
+        self.min_contour_area = 500 # contours smaller than this are ignored
+        self.roi = roi # only search a window around the last bar position, full frame search if the bar is lost
+        self.roi_margin = roi_margin # pixels added around the starting box size on every side of the window
+        self.roi_misses = 0 # number of frames the bar was lost inside the window
+        self.tracker = BarTracker() if tracker else None # predicts the bar position to gate contours
+        self.record_trajectory = record_trajectory # keep every box used for rep counting so reps can be counted offline
+        self.trajectory = [] # rows of frame index, timestamp, x, y, w, h & confidence
+        self.prefetch = prefetch # size of the decoded frame queue filled by a decoder thread, 0 decodes on the analysis thread
+        self.frame_source = None
+        self.analysis_s = 0.0 # time spent in process_frame
+        self.pipeline_stats = None # decode and analysis counters of the last run
+        if overlay is None and not headless:
+            overlay = OverlayRenderer(display=True)
+        self.overlay = overlay # draws the tracking results, None in batch runs so no drawing work is done
+        self.frame_boxes = [] # boxes processed in the current frame, for the overlay
+        self.skip_idle = skip_idle # skip the full processing of frames where the bar stands still, end the set once it is racked
+        self.idle_level = idle_level # grey level change that counts a pixel as changed
+        self.idle_pixels = idle_pixels # changed pixels around the bar that count as movement
+        self.rack_hold_s = rack_hold_s # seconds the bar stands still back in the starting box after a rep before the set is ended
+        self.walked_out = False # the bar has left the starting box sideways since the set started
+        self.idle_reference = None # (x0, y0, x1, y1, grey window) of the last fully processed frame
+        self.idle_grey = None # reused buffer of the grey window
+        self.idle_since_s = None # timestamp of the first idle frame of the current still period
+        self.frames_skipped = 0 # frames not processed because the bar stood still
+
+        # the starting position is found on the first frame(s) of this capture so each video is only opened and
+        # decoded once, the frames are kept and processed first by run
+        self.pending_frames = []
+        for _ in range(initial_frames):
+            ret, frame = self.read_frame()
+            if not ret:
+                break
+            self.pending_frames.append((frame, self.frame_index, self.frame_timestamp_s))
+        start_box = find_initial_coordinates_from_frames([frame for frame, _, _ in self.pending_frames])
+        if start_box is None:
+            self.cap.release()
+            raise ValueError(f"Failed to find the starting position of the barbell in {video_path}")
+        self.start_x, self.start_y, self.start_w, self.start_h = start_box # starting x, y, width & height co-ordinates of barbell
+        self.start_centroid = (int(self.start_x + self.start_w / 2), int(self.start_y + self.start_h / 2)) # centroid of the starting box
         
 
     def is_inside_bounding_box(self, x, y):
@@ -46,185 +111,461 @@ class VideoProcessor:
         '''
         return self.start_x <= x < self.start_x + self.start_w and self.start_y <= y < self.start_y + self.start_h
 
-    def process_frame(self, frame):
+    def read_frame(self):
         '''
-        This is the primary function of the VideoProcessor class
-        This function allows for the processing of the frame to derive distance, speed & repetitions from the video
+        Reads the next frame from the capture and records its index and timestamp,
+        the timestamp comes from the container (CAP_PROP_POS_MSEC) so it does not depend on how fast frames are processed.
         '''
-        # Start the timer for performance measurement
-        start_time_frame_ns = time.perf_counter_ns()
+        if self.resize is None:
+            ret, frame = self.cap.read()
+        else:
+            # decode into the same full size buffer every frame, only the downscaled copy is kept
+            ret, self.raw_frame = self.cap.read(self.raw_frame)
+            if ret:
+                frame = cv2.resize(self.raw_frame, self.resize, interpolation=cv2.INTER_AREA)
+        if not ret:
+            return False, None
 
-        # Convert frame to HSV color space to facilitate color masking
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        self.frame_index += 1
+        self.frame_timestamp_s = frame_timestamp_s(self.cap, self.frame_index, self.fps)
 
-        # Create a mask for blue colors defined by lower and upper thresholds
-        mask = cv2.inRange(hsv, self.lower_blue, self.upper_blue)
+        return True, frame
+
+    def next_frame(self):
+        '''
+        Returns the frames read ahead for the starting position first, then carries on reading the capture
+        either directly or from the decoder thread when prefetching
+        '''
+        if self.pending_frames:
+            frame, self.frame_index, self.frame_timestamp_s = self.pending_frames.pop(0)
+            return True, frame
+        if self.frame_source is not None:
+            ret, frame, frame_index, timestamp_s = self.frame_source.read()
+            if ret:
+                self.frame_index, self.frame_timestamp_s = frame_index, timestamp_s
+            return ret, frame
+        return self.read_frame()
+
+    def rep_duration_from_frames(self):
+        '''
+        Duration of the concentric phase in seconds measured on the video timeline.
+        Falls back to the number of tracked frames when both ends of the rep share a timestamp.
+        '''
+        duration_s = self.frame_timestamp_s - self.rep_start_timestamp_s
+        if duration_s <= 0:
+            duration_s = self.frame_count / self.fps
+        return duration_s
+
+    def roi_window(self, frame_shape):
+        '''
+        Returns the (x0, y0, x1, y1) window centred on the last bar position, the window is the size of the
+        starting box plus the margin on every side and is clipped to the frame.
+        When the tracker has a track the window is centred on its prediction and grows with its uncertainty.
+        '''
+        frame_h, frame_w = frame_shape[:2]
+        half_w = self.start_w + self.roi_margin
+        half_h = self.start_h + self.roi_margin
+        if self.tracker is not None and self.tracker.is_tracking:
+            x, y = self.tracker.predicted_centre()
+            radius_x, radius_y = self.tracker.search_radius()
+            half_w, half_h = int(half_w + radius_x), int(half_h + radius_y)
+        else:
+            x, y = self.positions.last()
+        return max(x - half_w, 0), max(y - half_h, 0), min(x + half_w, frame_w), min(y + half_h, frame_h)
+
+    def mask_contours(self, image, offset=(0, 0)):
+        '''
+        Colour masks the image and returns the contours found in it, offset moves the contours back into
+        full frame co-ordinates when the image is a window of the frame
+        '''
+        # Create a mask for blue colors defined by lower and upper thresholds, built into reused buffers
+        mask = self.colour_mask.apply(image)
 
         # Find contours in the mask
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        return contours
 
-        # Calculate centroid of the initial bounding box for referenc
-        centroid = (int(self.start_x + self.start_w / 2), int(self.start_y + self.start_h / 2))
+    def find_contours(self, frame):
+        '''
+        Finds the contours of the frame, in roi mode only the window around the last bar position is searched
+        and the full frame is only searched when there is no bar position yet or the bar is not in the window
+        '''
+        if self.roi and (len(self.positions) or (self.tracker is not None and self.tracker.is_tracking)):
+            x0, y0, x1, y1 = self.roi_window(frame.shape)
+            contours = self.mask_contours(frame[y0:y1, x0:x1], (x0, y0))
+            if any(cv2.contourArea(contour) > self.min_contour_area for contour in contours):
+                return contours
+            self.roi_misses += 1
 
-        # Draw a circle at the centroid in yellow
-        cv2.circle(frame, centroid, 5, (255, 255, 0), -1)
+        return self.mask_contours(frame)
 
-        # Process each contour detected in the mask
-        for contour in contours:
+    def find_bar_boxes(self, contours):
+        '''
+        Returns the bounding boxes of the contours that could be the barbell.
+        Without the tracker these are all large enough contours (square ones only for the left camera).
+        With the tracker only the box closest to the predicted position is returned, boxes outside the
+        tracker's gate are skipped before their area is even measured.
+        '''
+        boxes = [cv2.boundingRect(contour) for contour in contours]
+
+        if self.tracker is None:
+            bar_boxes = []
+            for contour, (x, y, w, h) in zip(contours, boxes):
+                # Consider only contours with a significant area
+                if cv2.contourArea(contour) <= self.min_contour_area:
+                    continue
+                # Skip non-square contours if specified by self.right flag
+                if not self.right and abs(w - h) > 15:
+                    continue
+                bar_boxes.append((x, y, w, h))
+            return bar_boxes
+
+        if self.tracker.is_tracking and boxes:
+            centres = np.array([(x + w / 2, y + h / 2) for x, y, w, h in boxes])
+            in_gate = np.flatnonzero(self.tracker.mahalanobis_sq(centres) <= self.tracker.gate ** 2)
+            contours = [contours[i] for i in in_gate]
+            boxes = [boxes[i] for i in in_gate]
+
+        candidates = []
+        for contour, (x, y, w, h) in zip(contours, boxes):
             area = cv2.contourArea(contour)
+            if area <= self.min_contour_area:
+                continue
+            if not self.right and abs(w - h) > 15:
+                continue
+            candidates.append((area, (x, y, w, h)))
+
+        if not candidates:
+            self.tracker.miss()
+            return []
+
+        if self.tracker.is_tracking:
+            best = self.tracker.select([(x + w / 2, y + h / 2) for _, (x, y, w, h) in candidates])
+            x, y, w, h = candidates[best][1]
+            self.tracker.update(x + w / 2, y + h / 2)
+        else:
+            # no track yet, start one on the largest candidate as the starting position does
+            x, y, w, h = max(candidates)[1]
+            self.tracker.start(x + w / 2, y + h / 2)
+
+        return [(x, y, w, h)]
+
+    def idle_window(self, frame_shape):
+        '''
+        Returns the (x0, y0, x1, y1) window around the last bar position (the starting box before there is one)
+        that is compared between frames to tell whether the bar moved
+        '''
+        frame_h, frame_w = frame_shape[:2]
+        if len(self.positions):
+            x, y = self.positions.last()
+        else:
+            x, y = self.start_centroid
+        half_w = self.start_w + self.roi_margin
+        half_h = self.start_h + self.roi_margin
+        return max(x - half_w, 0), max(y - half_h, 0), min(x + half_w, frame_w), min(y + half_h, frame_h)
+
+    def can_idle(self):
+        '''
+        Frames may only be skipped while the bar is waiting: before the set starts, or at the top between or after reps
+        '''
+        if not self.set_started:
+            return True
+        return self.rep_count > 0 and not self.eccentric_started and not self.concentric_started
 
-            # Consider only contours with a significant area
-            if area > 500:
-                x, y, w, h = cv2.boundingRect(contour)
+    def frame_is_idle(self, frame):
+        '''
+        Cheap check run before the full processing: compares the grey window around the bar with the same window of
+        the last fully processed frame, so slow drifts still add up until they count as movement.
+        Also ends the set once the bar is racked: after a rep, walked out of the starting box sideways and back into it,
+        and still there for rack_hold_s. A rest at lockout inside the starting box does not end the set, the reps
+        leave the box downwards only.
+        '''
+        if self.set_started and not self.walked_out and len(self.positions):
+            x, _ = self.positions.last()
+            self.walked_out = not self.start_x <= x < self.start_x + self.start_w
+
+        if not self.can_idle():
+            self.idle_reference = None
+            self.idle_since_s = None
+            return False
+
+        if self.idle_reference is not None:
+            x0, y0, x1, y1, reference = self.idle_reference
+            self.idle_grey = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=self.idle_grey)
+            changed = cv2.absdiff(self.idle_grey, reference) > self.idle_level
+            if np.count_nonzero(changed) <= self.idle_pixels:
+                if self.idle_since_s is None:
+                    self.idle_since_s = self.frame_timestamp_s
+                if (self.rep_count > 0 and self.walked_out and self.is_inside_bounding_box(*self.positions.last())
+                        and self.frame_timestamp_s - self.idle_since_s >= self.rack_hold_s):
+                    # racked after the final rep, nothing else to decode
+                    self.set_ended = True
+                return True
+
+        # moved (or first frame), process it fully and make it the new reference
+        self.idle_since_s = None
+        x0, y0, x1, y1 = self.idle_window(frame.shape)
+        self.idle_reference = (x0, y0, x1, y1, cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY))
+        self.idle_grey = None
+        return False
 
-                # Skip non-square contours if specified by self.right flag
-                if not self.right:
-                    if abs(w - h) > 15:
+    def process_frame(self, frame):
+        '''
+        This is the primary function of the VideoProcessor class
+        This function allows for the processing of the frame to derive distance, speed & repetitions from the video
+        '''
+        # Start the timer for performance measurement
+        start_time_frame_ns = time.perf_counter_ns()
+        self.rep_events = []
+
+        # Move the tracker on to this frame so its prediction can be used to search and gate
+        if self.tracker is not None:
+            self.tracker.predict()
+
+        # Find contours of the blue colour, either in the whole frame or in the window around the bar
+        contours = self.find_contours(frame)
+
+        # Process each bounding box that could be the barbell
+        self.frame_boxes = []
+        for x, y, w, h in self.find_bar_boxes(contours):
+            self.frame_boxes.append((x, y, w, h))
+
+            if self.record_trajectory:
+                confidence = self.tracker.confidence if self.tracker is not None else 1.0
+                self.trajectory.append((self.frame_index, self.frame_timestamp_s, x, y, w, h, confidence))
+
+            # Calculate center of the bounding box
+            center = (int(x + w / 2), int(y + h / 2))
+
+            # get radius of circle
+            ref_radius = min(self.start_w, self.start_h) // 2
+
+            # add x and y positions to the history
+            self.positions.append(center[0], center[1], self.frame_timestamp_s)
+
+            # use second last value to become the prev x and prev y values, the very first position is its own previous
+            if len(self.positions) > 1:
+                self.prev_x, self.prev_y = self.positions.last(2)
+            else:
+                self.prev_x, self.prev_y = center
+
+            # find the millimetre to per pixel value
+            mmpp = self.barbell_radius_mm / ref_radius
+
+            # find the level of displacement between frames for x and y values.
+            y_disp = self.prev_y - center[1]
+            x_disp = self.prev_x - center[0]
+            y_distance_per_frame = y_disp * mmpp
+
+            # if the set isn't started, wait for significant movement
+            if not self.set_started:
+                #if right handed camera check for movement from right to left, else left to right for left handed camera
+                if self.right:
+                    if y_disp < -2 and x_disp > 2:
+                        self.rep_ending_y_pos = self.positions.min_y() + ref_radius
+                        self.set_started = True
+                else:
+                    if y_disp < -2 and x_disp < -2:
+                        self.rep_ending_y_pos = self.positions.min_y() + ref_radius
+                        self.set_started = True
+
+            # checking to verify that a downward movement has begun
+            if self.set_started and not self.concentric_started:
+                if y_disp < -4:
+                    self.eccentric_started = True
+                    self.distance_check  = ((center[1] - self.rep_ending_y_pos) * mmpp) / 1000
+        
+                # eccentric movement has ended, concentric movement starts
+                if y_distance_per_frame > 4 and self.eccentric_started:
+                    self.bottom_x, self.bottom_y = center[0], center[1]
+                    self.rep_starting_pos = self.bottom_y
+                    self.concentric_started = True
+                    self.rep_start_time_ns = time.perf_counter_ns()
+                    self.rep_start_timestamp_s = self.frame_timestamp_s
+
+            # if the set has started and concentric has started, we track the number of frames to occur
+            elif self.set_started and self.concentric_started:
+                self.frame_count += 1
+
+                # if current y position is above the end position of the set start, a repetition is counted
+                if center[1] <= self.rep_ending_y_pos:
+                    self.concentric_started = False
+                    self.eccentric_started = False   
+
+                    if self.distance_check < 0.1:
                         continue
-
-                # Calculate center of the bounding box
-                center = (int(x + w / 2), int(y + h / 2))
-
-                # Draw a rectangle and a circle at the center of the contour
-                cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 255, 255), 2)
-                cv2.circle(frame, center, 5, (255, 255, 255), -1)
-
-                # get radius of circle and draw on screen
-                ref_radius = min(self.start_w, self.start_h) // 2
-                concentric_end_position_1 = (center[0] + ref_radius, center[1])
-                cv2.line(frame, center, concentric_end_position_1, (0, 0, 255), 2)
-
-                # Additional check if center is within the initial bounding box
-                if self.is_inside_bounding_box(center[0], center[1]):
-                    cv2.rectangle(frame, (self.start_x, self.start_y), (self.start_x+self.start_w, self.start_y+self.start_h), (255, 0, 255), 2)
-
-                # add x and y positions to list
-                self.x_positions.append(center[0])
-                self.y_positions.append(center[1])
-
-                # if prev_x and prev_y not set, set them to very first x and y position
-                if self.prev_x is None:
-                    self.prev_x = self.x_positions[0]
-                if self.prev_y is None:
-                    self.prev_y = self.y_positions[0]
-
-                # use second last value to become the prev x and prev y values
-                if len(self.x_positions) > 1:
-                    self.prev_x = self.x_positions[-2]
-                if len(self.y_positions) > 1:
-                    self.prev_y = self.y_positions[-2]
-
-                # find the millimetre to per pixel value
-                mmpp = self.barbell_radius_mm / ref_radius
-
-                # find the level of displacement between frames for x and y values.
-                y_disp = self.prev_y - center[1]
-                x_disp = self.prev_x - center[0]
-                y_distance_per_frame = y_disp * mmpp
-
-                # find the end position of the eccentric phase to draw the line
-                eccentric_end_position_0 = (0, self.rep_starting_pos)
-                eccentric_end_position_1 = (self.frame_width - 1, self.rep_starting_pos)
-                if self.rep_starting_pos is not None:
-                    cv2.line(frame, eccentric_end_position_0, eccentric_end_position_1, (255, 255, 255), 2)
-
-                # if the set isn't started, wait for significant movement
-                if not self.set_started:
-                    #if right handed camera check for movement from right to left, else left to right for left handed camera
-                    if self.right:
-                        if y_disp < -2 and x_disp > 2:
-                            self.rep_ending_y_pos = min(self.y_positions) + ref_radius
-                            self.set_started = True
+                    
+                    # primary functionality keeping track of the distance, nanoseconds and adjustments based on frames
+                    self.rep_count += 1
+                    if self.frame_timing:
+                        # the video timeline is already real time, no adjustment needed
+                        self.rep_duration_s = self.rep_duration_from_frames()
+                        adjustment_percentage = 1
                     else:
-                        if y_disp < -2 and x_disp < -2:
-                            self.rep_ending_y_pos = min(self.y_positions) + ref_radius
-                            self.set_started = True
-
-                # set has started if movement has occurred
-                if self.set_started:
-                    # this is the starting point of the overall repetition
-                    concentric_end_position_0 = (0, self.rep_ending_y_pos)
-                    concentric_end_position_1 = (self.frame_width - 1, self.rep_ending_y_pos)
-                    cv2.line(frame, concentric_end_position_0, concentric_end_position_1, (255, 0, 0), 2)
-
-                # checking to verify that a downward movement has begun
-                if self.set_started and not self.concentric_started:
-                    if y_disp < -4:
-                        self.eccentric_started = True
-                        self.distance_check  = ((center[1] - self.rep_ending_y_pos) * mmpp) / 1000
-        
-                    # eccentric movement has ended, concentric movement starts
-                    if y_distance_per_frame > 4 and self.eccentric_started:
-                        self.bottom_x, self.bottom_y = center[0], center[1]
-                        self.rep_starting_pos = self.bottom_y
-                        self.concentric_started = True
-                        self.rep_start_time_ns = time.perf_counter_ns()
-
-                # if the set has started and concentric has started, we track the number of frames to occur
-                elif self.set_started and self.concentric_started:
-                    self.frame_count += 1
-
-                    # if current y position is above the end position of the set start, a repetition is counted
-                    if center[1] <= self.rep_ending_y_pos:
-                        self.concentric_started = False
-                        self.eccentric_started = False   
-
-                        if self.distance_check < 0.1:
-                            continue
-                        
-                        # primary functionality keeping track of the distance, nanoseconds and adjustments based on frames
-                        self.rep_count += 1
                         rep_duration_ns = time.perf_counter_ns() - self.rep_start_time_ns
                         self.rep_duration_s = rep_duration_ns / 1_000_000_000
                         actual_fps = self.frame_count / self.rep_duration_s
                         adjustment_percentage = (self.fps/actual_fps)
-                        self.top_finish_x, self.top_finish_y = center[0], center[1]
-                        distance_metres = (abs(self.bottom_y - self.top_finish_y) * mmpp) / 1000
-                        if self.right:
-                            self.metres_per_second = (distance_metres / self.rep_duration_s) * adjustment_percentage
-                        self.metres_per_second_list.append(self.metres_per_second)
-                        self.frame_count = 0
-
-                # Performance based metrics displayed to screen for user
-                cv2.putText(frame, f"FPS: {self.fps:.2f}", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                cv2.putText(frame, f"Repetitions: {self.rep_count}", (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                cv2.putText(frame, f"Seconds: {self.rep_duration_s}", (20, 160), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                cv2.putText(frame, f"Metres/Second: {self.metres_per_second:.2f}", (20, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-
-                # draw a green line between the top and bottom range of the repetition, showing bar path
-                rep_start_path = (self.bottom_x, self.bottom_y)
-                rep_end_path = (self.top_finish_x, self.top_finish_y)
-
-                if self.top_finish_x is not None and self.top_finish_y is not None:
-                    cv2.line(frame, rep_start_path, rep_end_path, (0, 255, 0), 2)
-
-                if self.is_inside_bounding_box(x, y) and self.set_started:
-                    break
+                    self.top_finish_x, self.top_finish_y = center[0], center[1]
+                    distance_metres = (abs(self.bottom_y - self.top_finish_y) * mmpp) / 1000
+                    self.metres_per_second = (distance_metres / self.rep_duration_s) * adjustment_percentage
+                    self.metres_per_second_list.append(self.metres_per_second)
+                    self.frame_count = 0
+                    self.emit_rep(distance_metres)
+
+            if self.is_inside_bounding_box(x, y) and self.set_started:
+                break
+
+        # drawing is a separate stage driven by the state above, skipped entirely without an overlay
+        if self.overlay is not None:
+            self.overlay.render(frame, self)
+
+        if self.headless:
+            return 0
 
         # these series of counters check to see the expected frames to actual frames and allows for video to be shown in 
         # real time
         end_time_frame_ns = time.perf_counter_ns()
         processing_time_ns = end_time_frame_ns - start_time_frame_ns
         wait_time_ms = max((self.frame_delay_ns - processing_time_ns) // 1_000_000, 1)
-        cv2.imshow('Frame', frame)
 
         return wait_time_ms
 
-    def run(self):
+    def emit_rep(self, distance_metres):
+        '''
+        Hands the rep just counted to the on_rep callback and the stream, on the frame it is counted
+        '''
+        event = {
+            'rep': self.rep_count,
+            'frame_index': self.frame_index,
+            'timestamp_s': self.frame_timestamp_s,
+            'metres_per_second': self.metres_per_second,
+            'duration_s': self.rep_duration_s,
+            'distance_m': distance_metres,
+            'bottom': (self.bottom_x, self.bottom_y),
+            'top': (self.top_finish_x, self.top_finish_y),
+        }
+        self.rep_events.append(event)
+        if self.on_rep is not None:
+            self.on_rep(event)
+
+    def save_trajectory(self, path):
+        '''
+        Writes the recorded trajectory to an .npz file that rep_analysis.py can count reps from
+        '''
+        save_trajectory(path, self.trajectory, (self.start_x, self.start_y, self.start_w, self.start_h),
+                        self.right, self.fps, self.barbell_radius_mm)
 
-        while not self.set_ended:
-            ret, frame = self.cap.read()
-            if not ret:
-                break
-            wait_time_ms = self.process_frame(frame)
+    def trajectory_arrays(self):
+        '''
+        The recorded trajectory as the arrays load_trajectory returns, for use without writing a file
+        '''
+        return trajectory_arrays(self.trajectory, (self.start_x, self.start_y, self.start_w, self.start_h),
+                                 self.right, self.fps, self.barbell_radius_mm)
 
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-        self.cap.release()
-        cv2.destroyAllWindows()
+    def process_frames(self):
+        '''
+        Processes the source frame by frame, yields the rep events of each frame (usually none) once it is processed
+        '''
+        if self.prefetch:
+            # the frames already read for the starting position come first, the decoder carries on after them
+            self.frame_source = ThreadedFrameSource(self.cap, self.prefetch, self.fps, self.frame_index + 1, self.resize)
+
+        try:
+            while not self.set_ended and not self.stopping:
+                ret, frame = self.next_frame()
+                if not ret:
+                    break
+                if self.archive is not None:
+                    # before process_frame so the archived copy has no overlay drawn on it
+                    self.archive.write(frame, self.fps)
+                analysis_start = time.perf_counter()
+                if self.skip_idle and self.frame_is_idle(frame):
+                    self.rep_events = []
+                    self.frames_skipped += 1
+                    # the window and the annotated video still get every frame so playback is not sped up, the bar
+                    # has not moved so the boxes of the last processed frame are drawn again
+                    if self.overlay is not None:
+                        self.overlay.render(frame, self)
+                else:
+                    self.process_frame(frame)
+                self.analysis_s += time.perf_counter() - analysis_start
+                if self.frame_source is not None:
+                    self.frame_source.release(frame)
+
+                yield self.rep_events
+
+                if self.overlay is not None and self.overlay.display and cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        finally:
+            # also runs when a stream is closed before the end of the source
+            frames = self.frame_index + 1
+            self.pipeline_stats = {'frames': frames, 'frames_skipped': self.frames_skipped, 'analysis_s': self.analysis_s,
+                                   'analysis_fps': frames / self.analysis_s if self.analysis_s else 0.0}
+            if self.frame_source is not None:
+                self.frame_source.stop()
+                self.pipeline_stats.update(self.frame_source.stats())
+                self.frame_source = None
+            self.cap.release()
+            if self.archive is not None:
+                self.archive.close()
+            if self.overlay is not None:
+                self.overlay.close()
+
+    def stop(self):
+        '''
+        Asks the processing to stop after the current frame, safe to call from another thread
+        '''
+        self.stopping = True
 
+    def run(self):
+        for _ in self.process_frames():
+            pass
         return self.metres_per_second_list
 
+    def stream(self):
+        '''
+        Generator of rep events, each one is yielded right after the frame the rep was counted on
+        '''
+        for rep_events in self.process_frames():
+            yield from rep_events
+
+    async def stream_async(self):
+        '''
+        Async iterator of rep events, the frames are processed on a worker thread so the event loop is not blocked.
+        Use it headless or with an overlay that does not display, GUI windows need the main thread
+        '''
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def put(event):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                # the event loop is closed, nobody is left to read the event
+                pass
+
+        def produce():
+            try:
+                for event in self.stream():
+                    put(event)
+            finally:
+                # end of stream marker
+                put(None)
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # also runs when the consumer stops iterating early, a live source would otherwise be decoded forever
+            self.stop()
+            # raises any error of the worker thread
+            await producer
+
 
 if __name__ == "__main__":
     video_path = './videos/day3/R_03_01E.MOV'
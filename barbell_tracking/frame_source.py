@@ -0,0 +1,199 @@
+'''
+This script is used by the contour_track_21.py script to decode frames on a separate thread.
+
+A decoder thread reads frames into a small pool of reusable buffers and hands them over through a bounded queue,
+the analysis thread gives each buffer back once it is done with it. OpenCV releases the GIL while decoding and in
+most image processing calls, so decoding the next frame overlaps with the analysis of the current one.
+
+The counters show which side is the bottleneck: time the decoder spends blocked waiting for a free buffer means
+the analysis is slower, time the analysis spends waiting for a frame means the decoding is slower.
+
+Besides video files the VideoProcessor can read a camera, a stream url or named pipe, raw frames piped in on a file
+(pipe_frames) or any iterable of frames (IterableCapture), open_capture gives all of them the VideoCapture interface.
+
+Raw (e.g. 4k) videos can be downscaled on the fly: every frame is decoded into one reused full size buffer and only
+the downscaled copy is handed on, so no resized copy of the video has to be written and decoded again.
+'''
+
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+
+def frame_timestamp_s(cap, frame_index, fps):
+    '''
+    Timestamp of the frame just read from the capture, taken from the container (CAP_PROP_POS_MSEC).
+    Some backends report 0 for every frame, in that case the frame index and the nominal fps are used instead.
+    '''
+    timestamp_s = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+    if timestamp_s <= 0 and frame_index > 0:
+        timestamp_s = frame_index / fps
+    return timestamp_s
+
+
+class ThreadedFrameSource:
+    def __init__(self, cap, queue_size=8, fps=30, start_index=0, resize=None):
+        self.cap = cap
+        self.fps = fps
+        self.resize = resize # (width, height) the frames are downscaled to on the decoder thread, None keeps them as decoded
+        self.raw_frame = None # full size buffer decoded into when resizing
+        self.frames = queue.Queue(maxsize=queue_size) # decoded frames waiting to be analysed
+        self.free_buffers = queue.Queue() # buffers given back by the analysis, None until first allocated
+        for _ in range(queue_size + 2): # one extra buffer being analysed and one being decoded into
+            self.free_buffers.put(None)
+        self.next_index = start_index
+        self.stopping = False
+        self.frames_decoded = 0
+        self.decode_s = 0.0 # time spent in cap.read
+        self.decoder_blocked_s = 0.0 # time the decoder waited for a free buffer
+        self.consumer_wait_s = 0.0 # time the analysis waited for a decoded frame
+        self.started_s = time.perf_counter()
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        while not self.stopping:
+            wait_start = time.perf_counter()
+            buffer = self.free_buffers.get()
+            decode_start = time.perf_counter()
+            self.decoder_blocked_s += decode_start - wait_start
+            if self.stopping:
+                break
+
+            if self.resize is not None:
+                ret, self.raw_frame = self.cap.read(self.raw_frame)
+                if ret:
+                    frame = cv2.resize(self.raw_frame, self.resize, dst=buffer, interpolation=cv2.INTER_AREA)
+            elif buffer is None:
+                ret, frame = self.cap.read()
+            else:
+                ret, frame = self.cap.read(buffer)
+            self.decode_s += time.perf_counter() - decode_start
+            if not ret:
+                break
+
+            self.frames.put((frame, self.next_index, frame_timestamp_s(self.cap, self.next_index, self.fps)))
+            self.next_index += 1
+            self.frames_decoded += 1
+
+        # end of video marker
+        self.frames.put(None)
+
+    def read(self):
+        '''
+        Returns (ret, frame, frame index, timestamp), ret is False at the end of the video
+        '''
+        wait_start = time.perf_counter()
+        item = self.frames.get()
+        self.consumer_wait_s += time.perf_counter() - wait_start
+        if item is None:
+            # keep the marker for any later read
+            self.frames.put(None)
+            return False, None, None, None
+        frame, frame_index, timestamp_s = item
+        return True, frame, frame_index, timestamp_s
+
+    def release(self, frame):
+        '''
+        Gives a frame's buffer back to the decoder once the analysis is done with it
+        '''
+        self.free_buffers.put(frame)
+
+    def stop(self):
+        self.stopping = True
+        # wake the decoder if it is waiting for a buffer and make room if it is waiting to hand over a frame
+        self.free_buffers.put(None)
+        while self.thread.is_alive():
+            try:
+                self.frames.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def stats(self):
+        elapsed_s = time.perf_counter() - self.started_s
+        return {
+            'frames_decoded': self.frames_decoded,
+            'elapsed_s': elapsed_s,
+            'decode_s': self.decode_s,
+            'decoder_blocked_s': self.decoder_blocked_s,
+            'consumer_wait_s': self.consumer_wait_s,
+            'decode_fps': self.frames_decoded / self.decode_s if self.decode_s else 0.0,
+            'overall_fps': self.frames_decoded / elapsed_s if elapsed_s else 0.0,
+        }
+
+
+class IterableCapture:
+    '''
+    VideoCapture interface over an iterable of frames, or of (frame, timestamp in seconds) pairs.
+    Without timestamps the frames are taken to be fps apart.
+    '''
+    def __init__(self, frames, fps=30):
+        self.frames = iter(frames)
+        self.fps = fps
+        self.frame_index = -1
+        self.timestamp_s = 0.0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+        try:
+            item = next(self.frames)
+        except StopIteration:
+            self.opened = False
+            return False, None
+
+        self.frame_index += 1
+        if isinstance(item, tuple):
+            frame, self.timestamp_s = item
+        else:
+            frame, self.timestamp_s = item, self.frame_index / self.fps
+        # fill the caller's buffer like VideoCapture.read does, the generator may reuse its own frame
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame.copy()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.timestamp_s * 1000
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_index + 1
+        return 0.0
+
+    def set(self, prop, value):
+        # frames of an iterable can not be seeked to
+        return False
+
+    def release(self):
+        self.opened = False
+
+
+def pipe_frames(stream, width, height):
+    '''
+    Yields the raw bgr24 frames written to a binary stream, e.g. sys.stdin.buffer fed by
+    ffmpeg -i <input> -f rawvideo -pix_fmt bgr24 -
+    '''
+    frame_bytes = width * height * 3
+    while True:
+        data = stream.read(frame_bytes)
+        if len(data) < frame_bytes:
+            return
+        yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+
+def open_capture(source, fps=30):
+    '''
+    Opens a video file path, stream url or named pipe (str), a camera (int device index) or an iterable of frames
+    '''
+    if isinstance(source, (str, int)):
+        return cv2.VideoCapture(source)
+    return IterableCapture(source, fps)
@@ -0,0 +1,57 @@
+'''
+This script gives velocity feedback between repetitions, each rep is printed the moment it is counted.
+
+The frames can come from a camera, a stream url or named pipe, raw frames piped in on stdin or the synthetic set
+of synthetic_frames.py (no hardware needed):
+
+    python live_stream.py --camera 0
+    python live_stream.py --source rtsp://...
+    ffmpeg -i R_01_01E.MOV -f rawvideo -pix_fmt bgr24 - | python live_stream.py --stdin 1280x720
+    python live_stream.py --synthetic 5
+
+Other programs can use the same events through VideoProcessor(source, ..., on_rep=callback), VideoProcessor.stream()
+or the async iterator VideoProcessor.stream_async().
+'''
+
+import argparse
+import sys
+from contour_track_21 import VideoProcessor
+from frame_source import pipe_frames
+from synthetic_frames import synthetic_frames
+
+
+def print_rep(event):
+    print(f"Rep {event['rep']}: {event['metres_per_second']:.2f} m/s, {event['duration_s']:.2f} s, "
+          f"{event['distance_m']:.2f} m, bottom {event['bottom']} top {event['top']}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print each repetition's velocity as soon as it is counted")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--camera', type=int, help="camera device index")
+    source.add_argument('--source', help="video file, stream url or named pipe")
+    source.add_argument('--stdin', metavar='WIDTHxHEIGHT', help="raw bgr24 frames of this size piped in on stdin")
+    source.add_argument('--synthetic', type=int, metavar='REPS', help="a synthetic set of this many reps")
+    parser.add_argument('--left', action='store_true', help="left hand camera")
+    parser.add_argument('--fps', type=float, default=30, help="frame rate of sources that do not report one")
+    parser.add_argument('--display', action='store_true', help="show the tracking overlay in a window")
+    parser.add_argument('--tracker', action='store_true', help="gate contours with the predictive bar tracker")
+    args = parser.parse_args()
+
+    if args.camera is not None:
+        frames = args.camera
+    elif args.source is not None:
+        frames = args.source
+    elif args.stdin is not None:
+        width, height = (int(v) for v in args.stdin.lower().split('x'))
+        frames = pipe_frames(sys.stdin.buffer, width, height)
+    else:
+        frames = synthetic_frames(args.synthetic, unrack_dx=3 if args.left else -3)
+
+    processor = VideoProcessor(frames, not args.left, headless=not args.display, tracker=args.tracker, fps=args.fps,
+                               on_rep=print_rep)
+    processor.run()
+
+
+if __name__ == "__main__":
+    main()
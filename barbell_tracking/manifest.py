@@ -0,0 +1,89 @@
+'''
+This script is used by the video_analysis_factory.py script to remember which videos have already been processed.
+
+The manifest is a json file keyed by video path. Each entry holds the file size and modification time (and
+optionally a sha1 of the contents), the key of the tracker parameters the video was processed with and the
+results of the processing. A video only has to be processed again when it is new, when the file has changed or
+when the tracker or its parameters have changed.
+'''
+
+import hashlib
+import json
+import os
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def parameters_key(version, options):
+    '''
+    Short key for a tracker version and the options it is run with
+    '''
+    text = json.dumps({'version': version, 'options': options}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class VideoManifest:
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash # compare file contents when size or modification time have changed
+        self.videos = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.videos = json.load(f).get('videos', {})
+
+    @staticmethod
+    def key(video_path):
+        return os.path.normpath(video_path)
+
+    def fingerprint(self, video_path):
+        stat = os.stat(video_path)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if self.use_hash:
+            fingerprint['sha1'] = file_sha1(video_path)
+        return fingerprint
+
+    def lookup(self, video_path, params_key):
+        '''
+        Returns the cached results of the video, None if it has to be processed
+        '''
+        entry = self.videos.get(self.key(video_path))
+        if entry is None or entry['params'] != params_key:
+            return None
+
+        stat = os.stat(video_path)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            return entry['results']
+
+        # a touched but unchanged file is still up to date when the contents are compared
+        if self.use_hash and stat.st_size == entry['size'] and entry.get('sha1') == file_sha1(video_path):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return entry['results']
+        return None
+
+    def store(self, video_path, params_key, results):
+        entry = self.fingerprint(video_path)
+        entry['params'] = params_key
+        entry['results'] = results
+        self.videos[self.key(video_path)] = entry
+
+    def prune(self, video_paths):
+        '''
+        Forgets the videos that are no longer in the archive
+        '''
+        keep = {self.key(video_path) for video_path in video_paths}
+        for key in list(self.videos):
+            if key not in keep:
+                del self.videos[key]
+
+    def save(self):
+        # write to a temporary file first so an interrupted run can not leave a broken manifest
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'videos': self.videos}, f, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,117 @@
+'''
+This script is used by the contour_track_21.py script to draw the tracking results over the video.
+
+Drawing is kept apart from the tracking, the VideoProcessor only calls the renderer once per frame with its
+current state and without a renderer (batch runs) no drawing happens at all. The renderer can show the frames in a
+window, write them to an annotated video through a background writer thread, or both.
+'''
+
+import queue
+import threading
+import cv2
+
+RED = (0, 0, 255)
+
+
+class BackgroundVideoWriter:
+    '''
+    Writes frames to a video file on a separate thread so encoding does not hold up the tracking.
+    The writer is opened on the first frame so the frame size and fps do not have to be known in advance.
+    '''
+    def __init__(self, output_path, queue_size=32, fourcc='mp4v'):
+        self.output_path = output_path
+        self.fourcc = fourcc
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.writer = None
+        self.thread = None
+
+    def write(self, frame, fps):
+        if self.thread is None:
+            height, width = frame.shape[:2]
+            self.writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*self.fourcc), fps, (width, height))
+            if not self.writer.isOpened() and self.fourcc != 'mp4v':
+                # not every OpenCV build has an encoder for every fourcc (e.g. avc1), mp4v always works
+                self.writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            self.thread = threading.Thread(target=self.encode, daemon=True)
+            self.thread.start()
+        # the frame buffer may be reused for the next decoded frame, the writer keeps its own copy
+        self.frames.put(frame.copy())
+
+    def encode(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            self.writer.write(frame)
+        self.writer.release()
+
+    def close(self):
+        if self.thread is not None:
+            self.frames.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class OverlayRenderer:
+    def __init__(self, display=True, output_path=None, window_name='Frame'):
+        self.display = display # show the annotated frames in a window
+        self.window_name = window_name
+        self.writer = BackgroundVideoWriter(output_path) if output_path is not None else None
+
+    def draw(self, frame, processor):
+        '''
+        Draws the starting position, the boxes processed this frame, the rep lines, bar path and rep details
+        '''
+        # Draw a circle at the centroid of the initial bounding box in yellow
+        cv2.circle(frame, processor.start_centroid, 5, (255, 255, 0), -1)
+        if not processor.frame_boxes:
+            return
+
+        ref_radius = min(processor.start_w, processor.start_h) // 2
+        for x, y, w, h in processor.frame_boxes:
+            center = (int(x + w / 2), int(y + h / 2))
+
+            # Draw a rectangle and a circle at the center of the contour
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 255, 255), 2)
+            cv2.circle(frame, center, 5, (255, 255, 255), -1)
+
+            # radius of the starting box, used for the mm per pixel value
+            cv2.line(frame, center, (center[0] + ref_radius, center[1]), RED, 2)
+
+            # purple starting box while the barbell is inside it
+            if processor.is_inside_bounding_box(center[0], center[1]):
+                cv2.rectangle(frame, (processor.start_x, processor.start_y),
+                              (processor.start_x+processor.start_w, processor.start_y+processor.start_h), (255, 0, 255), 2)
+
+        # white line at the bottom of the last rep
+        if processor.rep_starting_pos is not None:
+            cv2.line(frame, (0, processor.rep_starting_pos), (processor.frame_width - 1, processor.rep_starting_pos), (255, 255, 255), 2)
+
+        # blue line a rep has to reach to be counted
+        if processor.set_started:
+            cv2.line(frame, (0, processor.rep_ending_y_pos), (processor.frame_width - 1, processor.rep_ending_y_pos), (255, 0, 0), 2)
+
+        # Performance based metrics displayed to screen for user
+        cv2.putText(frame, f"FPS: {processor.fps:.2f}", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1, RED, 2)
+        cv2.putText(frame, f"Repetitions: {processor.rep_count}", (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1, RED, 2)
+        cv2.putText(frame, f"Seconds: {processor.rep_duration_s}", (20, 160), cv2.FONT_HERSHEY_SIMPLEX, 1, RED, 2)
+        cv2.putText(frame, f"Metres/Second: {processor.metres_per_second:.2f}", (20, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, RED, 2)
+        if processor.tracker is not None:
+            cv2.putText(frame, f"Confidence: {processor.tracker.confidence:.2f}", (20, 240), cv2.FONT_HERSHEY_SIMPLEX, 1, RED, 2)
+
+        # draw a green line between the top and bottom range of the repetition, showing bar path
+        if processor.top_finish_x is not None and processor.top_finish_y is not None:
+            cv2.line(frame, (processor.bottom_x, processor.bottom_y), (processor.top_finish_x, processor.top_finish_y), (0, 255, 0), 2)
+
+    def render(self, frame, processor):
+        self.draw(frame, processor)
+        if self.display:
+            cv2.imshow(self.window_name, frame)
+        if self.writer is not None:
+            self.writer.write(frame, processor.fps)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.display:
+            cv2.destroyAllWindows()
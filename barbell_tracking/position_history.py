@@ -0,0 +1,72 @@
+'''
+This script is used by the contour_track_21.py script to keep the recent positions of the barbell.
+
+The positions are kept in fixed size numpy arrays used as a ring buffer, so memory stays the same however long the
+recording is. The minimum and maximum y positions in the buffer are kept up to date on every append with monotonic
+queues (amortised O(1)), so the set start check no longer scans the whole history.
+'''
+
+from collections import deque
+import numpy as np
+
+
+class PositionHistory:
+    def __init__(self, capacity=2000):
+        self.capacity = capacity
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.count = 0 # positions appended so far, including the ones overwritten
+        # (position number, y) pairs, increasing y values for the minimum and decreasing for the maximum
+        self.min_candidates = deque()
+        self.max_candidates = deque()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, x, y, timestamp_s=0.0):
+        slot = self.count % self.capacity
+        self.x[slot] = x
+        self.y[slot] = y
+        self.timestamps[slot] = timestamp_s if timestamp_s is not None else 0.0
+
+        # a new value makes every larger (smaller) earlier value useless as a future minimum (maximum)
+        while self.min_candidates and self.min_candidates[-1][1] >= y:
+            self.min_candidates.pop()
+        self.min_candidates.append((self.count, y))
+        while self.max_candidates and self.max_candidates[-1][1] <= y:
+            self.max_candidates.pop()
+        self.max_candidates.append((self.count, y))
+
+        # drop the candidates that have been overwritten
+        oldest = self.count - self.capacity + 1
+        if self.min_candidates[0][0] < oldest:
+            self.min_candidates.popleft()
+        if self.max_candidates[0][0] < oldest:
+            self.max_candidates.popleft()
+
+        self.count += 1
+
+    def last(self, offset=1):
+        '''
+        Returns the (x, y) position appended offset positions ago, last() is the newest position
+        '''
+        if offset > len(self):
+            raise IndexError("position history is not that long")
+        slot = (self.count - offset) % self.capacity
+        return int(self.x[slot]), int(self.y[slot])
+
+    def min_y(self):
+        return self.min_candidates[0][1]
+
+    def max_y(self):
+        return self.max_candidates[0][1]
+
+    def ordered(self):
+        '''
+        Returns copies of the x, y and timestamp arrays from oldest to newest
+        '''
+        if self.count <= self.capacity:
+            return self.x[:self.count].copy(), self.y[:self.count].copy(), self.timestamps[:self.count].copy()
+        order = np.roll(np.arange(self.capacity), -(self.count % self.capacity))
+        return self.x[order], self.y[order], self.timestamps[order]
@@ -0,0 +1,138 @@
+'''
+This script counts the repetitions of a stored trajectory (see trajectory.py) without decoding the video again.
+
+It follows the same set, eccentric and concentric rules as VideoProcessor.process_frame in headless mode, but
+works on whole numpy arrays: the displacements are computed for every row at once and the phase changes are found
+with searches over the rows that pass each threshold, so only one python step is taken per repetition.
+This makes it cheap to try different thresholds over every video of the study.
+
+Usage: python barbell_tracking/rep_analysis.py trajectories/ --eccentric-disp 4 --min-rep-distance 0.1
+'''
+
+import argparse
+import os
+import numpy as np
+from trajectory import load_trajectory
+
+
+def bar_centres(trajectory):
+    '''
+    Centre of every bounding box, rounded down as VideoProcessor does
+    '''
+    x = (trajectory['x'] + trajectory['w'] / 2).astype(np.int64)
+    y = (trajectory['y'] + trajectory['h'] / 2).astype(np.int64)
+    return x, y
+
+
+def first_after(indices, position):
+    '''
+    Returns the first value of the sorted indices that is >= position, None if there is none
+    '''
+    found = np.searchsorted(indices, position)
+    if found == len(indices):
+        return None
+    return int(indices[found])
+
+
+def find_reps(trajectory, set_start_disp=2, eccentric_disp=4, concentric_mm_per_frame=4, min_rep_distance_m=0.1,
+              history=2000):
+    '''
+    Finds every counted repetition of the trajectory.
+    Returns a list of dictionaries holding the row of the bottom and the top of each rep, its duration,
+    distance and metres per second.
+    '''
+    x, y = bar_centres(trajectory)
+    timestamps = trajectory['timestamp_s']
+    if len(y) == 0:
+        return []
+
+    start_w, start_h = trajectory['start_box'][2:]
+    ref_radius = min(start_w, start_h) // 2
+    mmpp = trajectory['barbell_radius_mm'] / ref_radius
+
+    # displacement from the previous row, the first row is compared with itself
+    y_disp = np.concatenate(([y[0]], y[:-1])) - y
+    x_disp = np.concatenate(([x[0]], x[:-1])) - x
+
+    # the set starts with the first significant movement away from the rack
+    if trajectory['right']:
+        set_start = np.flatnonzero((y_disp < -set_start_disp) & (x_disp > set_start_disp))
+    else:
+        set_start = np.flatnonzero((y_disp < -set_start_disp) & (x_disp < -set_start_disp))
+    if len(set_start) == 0:
+        return []
+    set_start = int(set_start[0])
+    rep_ending_y_pos = y[max(set_start - history + 1, 0):set_start + 1].min() + ref_radius
+
+    eccentric_rows = np.flatnonzero(y_disp < -eccentric_disp)
+    concentric_rows = np.flatnonzero(y_disp * mmpp > concentric_mm_per_frame)
+    top_rows = np.flatnonzero(y <= rep_ending_y_pos)
+
+    reps = []
+    row = set_start
+    while True:
+        eccentric_start = first_after(eccentric_rows, row)
+        if eccentric_start is None:
+            break
+        bottom = first_after(concentric_rows, eccentric_start + 1)
+        if bottom is None:
+            break
+        top = first_after(top_rows, bottom + 1)
+        if top is None:
+            break
+        row = top + 1
+
+        # the distance check uses the last downward row before the concentric phase started
+        last_eccentric = eccentric_rows[np.searchsorted(eccentric_rows, bottom) - 1]
+        distance_check = ((y[last_eccentric] - rep_ending_y_pos) * mmpp) / 1000
+        if distance_check < min_rep_distance_m:
+            continue
+
+        duration_s = timestamps[top] - timestamps[bottom]
+        if duration_s <= 0:
+            duration_s = (top - bottom) / trajectory['fps']
+        distance_metres = (abs(y[bottom] - y[top]) * mmpp) / 1000
+        metres_per_second = distance_metres / duration_s
+
+        reps.append({
+            'bottom_row': bottom,
+            'top_row': top,
+            'bottom': (int(x[bottom]), int(y[bottom])),
+            'top': (int(x[top]), int(y[top])),
+            'duration_s': float(duration_s),
+            'distance_m': float(distance_metres),
+            'metres_per_second': float(metres_per_second),
+        })
+
+    return reps
+
+
+def analyse_trajectory(trajectory, **thresholds):
+    '''
+    Rebuilds the metres_per_second_list VideoProcessor.run would return for the trajectory
+    '''
+    return [rep['metres_per_second'] for rep in find_reps(trajectory, **thresholds)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count reps again from stored trajectories")
+    parser.add_argument('folder', help="folder of .npz trajectory files")
+    parser.add_argument('--set-start-disp', type=float, default=2)
+    parser.add_argument('--eccentric-disp', type=float, default=4)
+    parser.add_argument('--concentric-mm-per-frame', type=float, default=4)
+    parser.add_argument('--min-rep-distance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    for filename in sorted(os.listdir(args.folder)):
+        if not filename.endswith('.npz'):
+            continue
+        speeds = analyse_trajectory(load_trajectory(os.path.join(args.folder, filename)),
+                                    set_start_disp=args.set_start_disp,
+                                    eccentric_disp=args.eccentric_disp,
+                                    concentric_mm_per_frame=args.concentric_mm_per_frame,
+                                    min_rep_distance_m=args.min_rep_distance)
+        print(filename, speeds)
+
+
+if __name__ == "__main__":
+    main()
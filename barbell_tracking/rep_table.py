@@ -0,0 +1,80 @@
+'''
+This script holds the storage format shared by the tracking, the models and the charts.
+
+Speeds are kept in long format, one row per camera, session, set and repetition with typed numeric columns,
+instead of a stringified python list per set. Tables are stored as compressed numpy .npz files (one array per
+column) which load directly into typed columns without any parsing, a csv copy is written next to each table so
+it can still be read by eye or opened in a spreadsheet.
+
+The video_analysis_factory.py script writes the rep table, model_analysis.py and model_analysis_factory.py read
+it and write the day analysis tables the charting scripts read.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+REP_TABLE_COLUMNS = ['Camera', 'SessionNumber', 'SetNumber', 'SetLabel', 'Filename', 'Rep', 'Speed']
+
+
+def rep_table_from_video_info(video_info_list):
+    '''
+    Builds the rep table from the video details of video_analysis_factory.py, one row per repetition.
+    SetLabel keeps the set part of the filename (e.g. 01E), SetNumber is its leading number.
+    '''
+    video_df = pd.DataFrame(video_info_list, columns=['Camera', 'SessionNumber', 'SetNumber', 'Filename', 'AverageSpeeds'])
+    video_df = video_df.rename(columns={'SetNumber': 'SetLabel'})
+    video_df['Rep'] = video_df['AverageSpeeds'].apply(lambda speeds: list(range(1, len(speeds) + 1)))
+    rep_df = video_df.explode(['AverageSpeeds', 'Rep']).dropna(subset=['Rep'])
+    rep_df = rep_df.rename(columns={'AverageSpeeds': 'Speed'})
+
+    rep_df['SessionNumber'] = rep_df['SessionNumber'].astype(int)
+    rep_df['SetNumber'] = rep_df['SetLabel'].str[0:2].astype(int)
+    rep_df['Rep'] = rep_df['Rep'].astype(int)
+    rep_df['Speed'] = rep_df['Speed'].astype(float)
+    return rep_df[REP_TABLE_COLUMNS].reset_index(drop=True)
+
+
+def rep_table_from_legacy_csv(csv_file):
+    '''
+    Converts a video_info_sorted.csv file with its stringified AverageSpeeds lists into the rep table
+    '''
+    video_df = pd.read_csv(csv_file, dtype={'SessionNumber': str, 'SetNumber': str})
+    video_df['AverageSpeeds'] = video_df['AverageSpeeds'].apply(
+        lambda x: [float(speed) for speed in x.strip('[]').split(', ') if speed])
+    return rep_table_from_video_info(video_df.to_dict('records'))
+
+
+def save_table(df, path, csv=True):
+    '''
+    Saves the table to an .npz file, one array per column, and a csv copy with the same name
+    '''
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        columns[column] = values
+    np.savez_compressed(path, __columns__=np.array(list(df.columns)), **columns)
+    if csv:
+        df.to_csv(os.path.splitext(path)[0] + '.csv', index=False)
+
+
+def load_table(path):
+    '''
+    Loads a table saved by save_table, csv copies can be loaded as well
+    '''
+    path = os.path.expanduser(path)
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    with np.load(path) as data:
+        return pd.DataFrame({str(column): data[str(column)] for column in data['__columns__']})
+
+
+def load_rep_table(path):
+    '''
+    Loads the rep table, a legacy video_info_sorted.csv file is converted on the way in
+    '''
+    if path.endswith('.csv') and 'AverageSpeeds' in pd.read_csv(path, nrows=0).columns:
+        return rep_table_from_legacy_csv(path)
+    return load_table(path)
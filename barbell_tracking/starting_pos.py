@@ -5,36 +5,53 @@ This script is used by the contour_track.py script to keep track of the initial
 import cv2
 import numpy as np
 
-def find_initial_coordinates(video_path):
+def find_coordinates_in_frame(frame):
     '''
-    This function returns to the primary tracker a purple bounding box around the starting position of the barbell,
-    whilst this functionality could be kept in the same script, it is easier to track while separated.
+    Returns the bounding box (x, y, w, h) of the largest light-blue object in the frame, None if there is none.
+    Used on the first frame(s) the VideoProcessor reads so the video does not have to be opened a second time.
     '''
     lower_blue = np.array([90, 120, 120])
     upper_blue = np.array([100, 255, 255])
-    cap = cv2.VideoCapture(video_path)
-    success, frame = cap.read()
-
-    if not success:
-        print("Failed to read video")
-        cap.release()
-        return None
 
     # Convert frame to HSV
     hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    
+
     # Create a mask for the specified color
     mask = cv2.inRange(hsv, lower_blue, upper_blue)
-    
+
     # Find contours
     contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    
-    cap.release()
 
     # If contours are found, return the coordinates of the first detected object
     if contours:
         c = max(contours, key=cv2.contourArea)
         x, y, w, h = cv2.boundingRect(c)
         return (x, y, w, h)
-    
+
     return None
+
+def find_initial_coordinates_from_frames(frames):
+    '''
+    Consensus starting position over several frames, the median of the boxes found in each frame.
+    A single frame with a hand or a reflection over the barbell then can not move the starting box.
+    '''
+    boxes = [box for box in (find_coordinates_in_frame(frame) for frame in frames) if box is not None]
+    if not boxes:
+        return None
+
+    return tuple(int(v) for v in np.median(np.array(boxes), axis=0))
+
+def find_initial_coordinates(video_path):
+    '''
+    This function returns to the primary tracker a purple bounding box around the starting position of the barbell,
+    whilst this functionality could be kept in the same script, it is easier to track while separated.
+    '''
+    cap = cv2.VideoCapture(video_path)
+    success, frame = cap.read()
+    cap.release()
+
+    if not success:
+        print("Failed to read video")
+        return None
+
+    return find_coordinates_in_frame(frame)
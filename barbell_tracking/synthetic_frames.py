@@ -0,0 +1,49 @@
+'''
+This script generates frames of a synthetic set, a light-blue square (the barbell's colour marker) on a grey
+background that is unracked and then squatted for a number of repetitions.
+
+It needs no camera or video file, so the streaming mode and the rep counting of the VideoProcessor can be tried
+and checked anywhere:
+
+    processor = VideoProcessor(synthetic_frames(reps=3), True, headless=True)
+    for event in processor.stream():
+        print(event)
+'''
+
+import cv2
+import numpy as np
+
+# bgr colour in the middle of the light-blue hsv range the VideoProcessor looks for
+BAR_BGR = tuple(int(v) for v in cv2.cvtColor(np.uint8([[[95, 200, 200]]]), cv2.COLOR_HSV2BGR)[0, 0])
+
+
+def synthetic_positions(reps=5, start=(700, 200), depth_px=200, eccentric_frames=30, concentric_frames=20,
+                        pause_frames=10, rack_frames=30, unrack_dx=-3):
+    '''
+    (x, y) centre of the bar on every frame: racked, a short unrack down and sideways, the repetitions and racked again.
+    The right camera sees the unrack move to the left (negative unrack_dx), the left camera to the right
+    '''
+    x, y = start
+    positions = [(x, y)] * rack_frames
+    for _ in range(3):
+        x, y = x + unrack_dx, y + 3
+        positions.append((x, y))
+
+    top = y
+    for _ in range(reps):
+        positions += [(x, top + depth_px * (i + 1) // eccentric_frames) for i in range(eccentric_frames)]
+        positions += [(x, top + depth_px - depth_px * (i + 1) // concentric_frames) for i in range(concentric_frames)]
+        positions += [(x, top)] * pause_frames
+    positions += [(x, top)] * rack_frames
+    return positions
+
+
+def synthetic_frames(reps=5, width=1280, height=720, half_size=20, **position_options):
+    '''
+    Yields one bgr frame per position of synthetic_positions, the same buffer is redrawn for every frame
+    '''
+    frame = np.empty((height, width, 3), np.uint8)
+    for x, y in synthetic_positions(reps, **position_options):
+        frame[:] = 40
+        cv2.rectangle(frame, (x - half_size, y - half_size), (x + half_size, y + half_size), BAR_BGR, -1)
+        yield frame
@@ -0,0 +1,58 @@
+'''
+This script is used by the contour_track_21.py script to store the path of the barbell found in a video.
+
+Every bounding box the VideoProcessor hands to its rep counting is one row of the trajectory: frame index, timestamp,
+centre and box size (and the tracker confidence when the tracker is used). Together with the starting box and the
+camera side this is everything the rep counting needs, so the reps can be counted again by rep_analysis.py
+without decoding the video.
+'''
+
+import numpy as np
+
+TRAJECTORY_COLUMNS = ('frame_index', 'timestamp_s', 'x', 'y', 'w', 'h', 'confidence')
+
+
+def trajectory_arrays(rows, start_box, right, fps, barbell_radius_mm=50):
+    '''
+    Builds the dictionary of arrays load_trajectory returns from the trajectory rows (tuples in TRAJECTORY_COLUMNS order)
+    '''
+    rows = np.asarray(rows, dtype=float).reshape(-1, len(TRAJECTORY_COLUMNS))
+    return {
+        'frame_index': rows[:, 0].astype(np.int32),
+        'timestamp_s': rows[:, 1],
+        'x': rows[:, 2].astype(np.int32),
+        'y': rows[:, 3].astype(np.int32),
+        'w': rows[:, 4].astype(np.int32),
+        'h': rows[:, 5].astype(np.int32),
+        'confidence': rows[:, 6].astype(np.float32),
+        'start_box': tuple(int(v) for v in start_box),
+        'right': bool(right),
+        'fps': float(fps),
+        'barbell_radius_mm': float(barbell_radius_mm),
+    }
+
+
+def save_trajectory(path, rows, start_box, right, fps, barbell_radius_mm=50):
+    '''
+    Writes the trajectory rows (tuples in TRAJECTORY_COLUMNS order) to a compressed .npz file
+    '''
+    trajectory = trajectory_arrays(rows, start_box, right, fps, barbell_radius_mm)
+    trajectory['start_box'] = np.asarray(trajectory['start_box'], dtype=np.int32)
+    trajectory['right'] = np.bool_(trajectory['right'])
+    trajectory['fps'] = np.float64(trajectory['fps'])
+    trajectory['barbell_radius_mm'] = np.float64(trajectory['barbell_radius_mm'])
+    np.savez_compressed(path, **trajectory)
+
+
+def load_trajectory(path):
+    '''
+    Reads a trajectory file back into a dictionary of arrays, scalar values are returned as python values
+    '''
+    with np.load(path) as data:
+        trajectory = {key: data[key] for key in data.files}
+
+    trajectory['start_box'] = tuple(int(v) for v in trajectory['start_box'])
+    trajectory['right'] = bool(trajectory['right'])
+    trajectory['fps'] = float(trajectory['fps'])
+    trajectory['barbell_radius_mm'] = float(trajectory['barbell_radius_mm'])
+    return trajectory
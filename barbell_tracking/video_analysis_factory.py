@@ -1,70 +1,244 @@
 '''
 This script picks up all contained videos stored in each of the video folders and uses
-the VideoProcessor class to create processor objects, a loop occurs and all details derived
-from the processing are stored to the "video_info_sorted.csv" file for further processing
+the VideoProcessor class to create processor objects, all details derived
+from the processing are stored to the "video_info_sorted.csv" file and, one row per repetition, to the
+"rep_table.npz" rep table (see rep_table.py) for further processing
 
-Prior to starting this, it is suggested you change the "wait_time_ms" variable to 1 in the "contour_track_21.py" script
-As this will speed up processing. 
+Processors are created in headless mode, no windows are shown and rep timing is taken from the frame timestamps
+of the video, so videos are processed at full decode speed and the m/s values do not depend on the machine.
+
+Videos are spread over a pool of worker processes (--workers, defaults to the number of cores), results are
+printed as each video finishes and sorted afterwards so the csv file is the same whatever order they finish in.
+
+Raw videos can be analysed directly (--resize 1280x720 --start-s 1), the frames are downscaled in memory as they are
+decoded instead of by a separate resize_videos.py pass, --archive keeps a downscaled copy of each video as well.
+
+Results are cached in a manifest (--manifest, see manifest.py), only new or changed videos and videos processed
+by another tracker version or with other options are processed again, the rest are taken from the manifest.
 
 '''
 
 import contour_track_21 as vp
+from overlay import OverlayRenderer
+from manifest import VideoManifest, parameters_key
+from rep_table import rep_table_from_video_info, save_table
+import argparse
 import os
 import pprint
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.MOV')  # Add other video formats as needed
+NON_RESULT_OPTIONS = ('prefetch',)  # processor options that do not change the results, left out of the manifest key
+# processor options added after the manifest, left out of its key at these defaults so results cached before them stay valid
+NEW_OPTION_DEFAULTS = {'resize': None, 'start_s': 0.0, 'skip_idle': False}
+# options no longer passed by the command line, kept in the key at the value they were passed with so older
+# manifests stay valid ('lut' masks are slower than 'hsv', see benchmark_colour_mask.py, so only 'hsv' is offered)
+FORMER_OPTION_DEFAULTS = {'mask_method': 'hsv'}
+
+
+def find_videos(video_root='./videos', days=range(0, 5)):
+    '''
+    Returns (day, filename, video_path) for every video in the day folders, day0 to day4 by default
+    '''
+    videos = []
+    for day in days:
+        video_folder = os.path.join(video_root, f'day{day}')
+        for filename in sorted(os.listdir(video_folder)):
+            if filename.endswith(VIDEO_EXTENSIONS):
+                videos.append((day, filename, os.path.join(video_folder, filename)))
+    return videos
+
+
+def process_video(day, filename, video_path, trajectory_folder=None, annotate_folder=None, archive_folder=None, **processor_options):
+    '''
+    Worker function, runs a headless VideoProcessor over one video and returns its average speeds
+    Kept at module level so it can be sent to the worker processes, processor_options are passed on to VideoProcessor
+    When a trajectory folder is given the bar path is saved there so reps can be counted again with rep_analysis.py
+    When an annotate folder is given an annotated copy of the video is written there, otherwise nothing is drawn
+    When an archive folder is given the frames as analysed (e.g. downscaled) are written there, as resize_videos.py would
+    '''
+    camera = filename.split('_')[0]
+    overlay = None
+    if annotate_folder is not None:
+        overlay = OverlayRenderer(display=False, output_path=os.path.join(annotate_folder, os.path.splitext(filename)[0] + '.mp4'))
+    archive_path = None
+    if archive_folder is not None:
+        archive_path = archive_path_of(archive_folder, filename)
+    processor = vp.VideoProcessor(video_path, camera == "R", headless=True, overlay=overlay, archive_path=archive_path,
+                                  record_trajectory=trajectory_folder is not None, **processor_options)
+    average_speeds = processor.run()
+    print(filename, processor.pipeline_stats)
+    if trajectory_folder is not None:
+        processor.save_trajectory(os.path.join(trajectory_folder, os.path.splitext(filename)[0] + '.npz'))
+    return day, filename, average_speeds
+
+
+def build_video_info(filename, average_speeds):
+    '''
+    Builds the csv row for a video from the details encoded in its filename, returns None if the filename has
+    less than 3 parts
+    '''
+    parts = filename.split('_')
+    if len(parts) < 3:  # Ensure the filename has at least 3 parts
+        return None
+
+    return {
+        'Camera': parts[0],
+        'SessionNumber': parts[1],
+        'SetNumber': parts[2].split('.')[0],  # Remove file extension for the set_id
+        'Filename': filename,
+        'AverageSpeeds': average_speeds,
+        'set_size': len(average_speeds),
+    }
+
+
+def check_rep_count(day, video_info):
+    '''
+    Days 1 through 4 and sets 1 through 4 are expected to have 5 reps, returns a message if this is not the case
+    '''
+    set_number = int(video_info['SetNumber'][0:2])  # Convert set_id to an integer for comparison
+    if 1 <= day <= 4 and 1 <= set_number <= 4:
+        rep_count = video_info['set_size']
+        if rep_count != 5:
+            return (f"Camera {video_info['Camera']} Day {day}, Set {set_number} in session "
+                    f"{video_info['SessionNumber']} has {rep_count} reps, expected 5.")
+    return None
+
+
+def archive_path_of(archive_folder, filename):
+    # same name as resize_videos.py gives its output
+    return os.path.join(archive_folder, os.path.splitext(filename)[0] + 'E.MOV')
+
+
+def outputs_missing(filename, trajectory_folder, annotate_folder, archive_folder=None):
+    '''
+    Cached results are only used when the trajectory, annotated video and archived video asked for are there as well
+    '''
+    name = os.path.splitext(filename)[0]
+    return ((trajectory_folder is not None and not os.path.exists(os.path.join(trajectory_folder, name + '.npz')))
+            or (annotate_folder is not None and not os.path.exists(os.path.join(annotate_folder, name + '.mp4')))
+            or (archive_folder is not None and not os.path.exists(archive_path_of(archive_folder, filename))))
+
+
+def analyse_videos(videos, workers=None, trajectory_folder=None, annotate_folder=None, manifest=None, archive_folder=None,
+                   **processor_options):
+    '''
+    Processes the videos over a pool of worker processes, each result is reported as soon as it finishes.
+    With a manifest, videos whose cached results are still valid are not processed again.
+    A video that fails to process (e.g. no starting position found) is reported with the rep check issues and the
+    other videos carry on, its results are not stored in the manifest so it is tried again on the next run.
+    Returns the sorted list of video details and the sorted list of rep check issues.
+    '''
+    params = parameters_key(vp.TRACKER_VERSION, {option: value for option, value in {**FORMER_OPTION_DEFAULTS,
+                                                                                     **processor_options}.items()
+                                                 if option not in NON_RESULT_OPTIONS
+                                                 and not (option in NEW_OPTION_DEFAULTS
+                                                          and value == NEW_OPTION_DEFAULTS[option])})
+
+    results = []
+    failures = []
+    to_process = []
+    for day, filename, video_path in videos:
+        cached = None
+        if manifest is not None and not outputs_missing(filename, trajectory_folder, annotate_folder, archive_folder):
+            cached = manifest.lookup(video_path, params)
+        if cached is None:
+            to_process.append((day, filename, video_path))
+        else:
+            results.append((day, filename, cached['AverageSpeeds']))
+    print(f"{len(to_process)} of {len(videos)} videos to process, {len(results)} taken from the manifest")
+
+    if to_process:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_video, *video, trajectory_folder=trajectory_folder,
+                                       annotate_folder=annotate_folder, archive_folder=archive_folder,
+                                       **processor_options): video
+                       for video in to_process}
+            for future in as_completed(futures):
+                day, filename, video_path = futures[future]
+                try:
+                    _, _, average_speeds = future.result()
+                except Exception as error:
+                    print(filename, "failed:", error)
+                    failures.append((day, filename, f"Day {day} video {filename} could not be processed: {error}"))
+                    continue
+                print(filename, average_speeds)
+                results.append((day, filename, average_speeds))
+                if manifest is not None:
+                    # saved after every video so an interrupted run keeps what it has done
+                    manifest.store(video_path, params, {'AverageSpeeds': average_speeds})
+                    manifest.save()
+
+    if manifest is not None:
+        manifest.prune([video_path for _, _, video_path in videos])
+        manifest.save()
+
+    video_info_list = []
+    rep_check_results = list(failures)
+    for day, filename, average_speeds in results:
+        video_info = build_video_info(filename, average_speeds)
+        if video_info is None:
+            continue
+        video_info_list.append(video_info)
+
+        rep_check = check_rep_count(day, video_info)
+        if rep_check is not None:
+            rep_check_results.append((day, filename, rep_check))
+
+    # Sort after collection, results arrive in whichever order the workers finish
+    sorted_video_info_list = sorted(video_info_list, key=lambda x: (x['Camera'], x['SessionNumber'], x['SetNumber']))
+    return sorted_video_info_list, [rep_check for _, _, rep_check in sorted(rep_check_results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process every study video and write video_info_sorted.csv")
+    parser.add_argument('--videos', default='./videos', help="folder holding the day0..day4 video folders")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, defaults to the number of cores")
+    parser.add_argument('--roi', action='store_true', help="only search a window around the last bar position")
+    parser.add_argument('--tracker', action='store_true', help="gate contours with the predictive bar tracker")
+    parser.add_argument('--initial-frames', type=int, default=1, help="frames used to agree on the starting position")
+    parser.add_argument('--prefetch', type=int, default=0, help="decode on a separate thread with a queue of this many frames")
+    parser.add_argument('--trajectories', default=None, help="folder to save each video's bar trajectory to")
+    parser.add_argument('--annotate', default=None, help="folder to write annotated copies of the videos to")
+    parser.add_argument('--resize', default=None, metavar='WIDTHxHEIGHT', help="downscale raw videos in memory, e.g. 1280x720")
+    parser.add_argument('--start-s', type=float, default=0.0, help="seconds skipped at the start of every video")
+    parser.add_argument('--skip-idle', action='store_true', help="skip frames where the bar stands still, stop once it is racked")
+    parser.add_argument('--archive', default=None, help="folder to write the downscaled copies of the videos to")
+    parser.add_argument('--manifest', default='video_manifest.json', help="manifest of processed videos and their results")
+    parser.add_argument('--no-manifest', action='store_true', help="process every video and leave the manifest alone")
+    parser.add_argument('--hash', action='store_true', help="compare file contents when a video's size or time changes")
+    parser.add_argument('--output', default='video_info_sorted.csv', help="csv file to write")
+    parser.add_argument('--rep-table', default='rep_table.npz', help="rep table to write, a csv copy is written next to it")
+    args = parser.parse_args()
+
+    pp = pprint.PrettyPrinter(indent=4)
+    for folder in (args.trajectories, args.annotate, args.archive):
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+    manifest = None if args.no_manifest else VideoManifest(args.manifest, args.hash)
+    resize = tuple(int(v) for v in args.resize.lower().split('x')) if args.resize is not None else None
+    sorted_video_info_list, rep_check_results = analyse_videos(find_videos(args.videos), args.workers,
+                                                               args.trajectories, args.annotate, manifest, args.archive,
+                                                               roi=args.roi, tracker=args.tracker,
+                                                               initial_frames=args.initial_frames, prefetch=args.prefetch,
+                                                               resize=resize,
+                                                               start_s=args.start_s, skip_idle=args.skip_idle)
+
+    # Convert to DataFrame and save
+    video_df = pd.DataFrame(sorted_video_info_list)
+    video_df.to_csv(args.output, index=False)
+    save_table(rep_table_from_video_info(sorted_video_info_list), args.rep_table)
+
+    # Print sorted list and any rep check issues
+    pp.pprint(sorted_video_info_list)
+    if rep_check_results:
+        print("Issues found with processing or repetition counts:")
+        for result in rep_check_results:
+            print(result)
+    else:
+        print("All checked sets have the correct number of repetitions.")
+
 
-# Initialize variables
-video_info_list = []
-rep_check_results = []  # To store results of the rep checks
-pp = pprint.PrettyPrinter(indent=4)
-
-# Loop from day0 to day4
-for day in range(0,5):  # Generates numbers 0 through 4
-    video_folder = f'./videos/day{day}'
-    
-    for filename in os.listdir(video_folder):
-        if filename.endswith(('.mp4', '.avi', '.MOV')):  # Add other video formats as needed
-            print(filename)
-            parts = filename.split('_')
-            camera = parts[0]
-    
-            video_path = os.path.join(video_folder, filename)
-            processor = vp.VideoProcessor(video_path, camera == "R")
-            average_speeds = processor.run()
-    
-            if len(parts) >= 3:  # Ensure the filename has at least 3 parts
-                session_id = parts[1]
-                set_id = parts[2].split('.')[0]  # Remove file extension for the set_id
-                set_number = int(set_id[0:2]) # Convert set_id to an integer for comparison
-                
-                video_info = {
-                    'Camera': camera,
-                    'SessionNumber': session_id,
-                    'SetNumber': set_id,
-                    'Filename': filename,
-                    'AverageSpeeds': average_speeds,
-                    'set_size': len(average_speeds),
-                }
-                video_info_list.append(video_info)
-                
-                # Check for days 1 through 4 and sets 1 through 4
-                if 1 <= day <= 4 and 1 <= set_number <= 4:
-                    rep_count = len(average_speeds)
-                    if rep_count != 5:
-                        rep_check_results.append(f"Camera {camera} Day {day}, Set {set_number} in session {session_id} has {rep_count} reps, expected 5.")
-
-# Sort and process the list after collection
-sorted_video_info_list = sorted(video_info_list, key=lambda x: (x['Camera'], x['SessionNumber'], x['SetNumber']))
-
-# Convert to DataFrame and save
-video_df = pd.DataFrame(sorted_video_info_list)
-video_df.to_csv("video_info_sorted.csv", index=False)
-
-# Print sorted list and any rep check issues
-pp.pprint(sorted_video_info_list)
-if rep_check_results:
-    print("Issues found with repetition counts:")
-    for result in rep_check_results:
-        print(result)
-else:
-    print("All checked sets have the correct number of repetitions.")
+if __name__ == "__main__":
+    main()
@@ -9,125 +9,95 @@ For Speeds it takes the final repetition of each set and its respective m/s vari
 
 Each of these variables are compared across successive days to attempt verification of fatigue build up.
 
+plot_comparison builds one of the comparison figures from the analysis tables of any number of days,
+render_charts.py uses it to write the figures to files. Run on its own the script shows them.
 '''
 
-import pandas as pd
-import ast
+import argparse
+import glob
+import os
+import re
 import matplotlib.pyplot as plt
 import numpy as np
-
-# Load the CSV file into a DataFrame
-day_1_df = pd.read_csv('~/Downloads/main_functionalityv4/analysis_results/day_1_analysis.csv')
-day_2_df = pd.read_csv('~/Downloads/main_functionalityv4/analysis_results/day_2_analysis.csv')
-day_3_df = pd.read_csv('~/Downloads/main_functionalityv4/analysis_results/day_3_analysis.csv')
-day_4_df = pd.read_csv('~/Downloads/main_functionalityv4/analysis_results/day_4_analysis.csv')
-
-# Function to convert string representation of list to list
-def convert_to_list(s):
-    return ast.literal_eval(s)
-
-# Apply the conversion function to relevant columns
-for df in [day_1_df, day_2_df, day_3_df, day_4_df]:
-    df['Speeds'] = df['Speeds'].apply(convert_to_list)
-    df['Predicted RIR'] = df['Predicted RIR'].apply(convert_to_list)
-    df['Predicted Percentages'] = df['Predicted Percentages'].apply(convert_to_list)
-    df['Predicted Weights'] = df['Predicted Weights'].apply(convert_to_list)
+from barbell_tracking.rep_table import load_table
+
+
+def find_day_tables(analysis_folder):
+    '''
+    Returns {day: path} of the day_N_analysis.npz tables in the folder, sorted by day
+    '''
+    days = {}
+    for path in glob.glob(os.path.join(os.path.expanduser(analysis_folder), 'day_*_analysis.npz')):
+        match = re.fullmatch(r'day_(\d+)_analysis\.npz', os.path.basename(path))
+        if match:
+            days[int(match.group(1))] = path
+    return dict(sorted(days.items()))
+
+def camera_groups(df):
+    '''
+    Splits an analysis table by camera, returns (label suffix, table) pairs. The suffix names the camera when the
+    table holds more than one, so the reps of the left and right videos of a set are never mixed into one series.
+    Tables written before the Camera column was kept are returned whole.
+    '''
+    if 'Camera' not in df.columns or df['Camera'].nunique() <= 1:
+        return [('', df)]
+    return [(f' {camera}', camera_df) for camera, camera_df in df.groupby('Camera', sort=True)]
 
 # Function to compute estimated 1RM
 def compute_estimated_1RM(df):
-    estimated_1RM = []
-    for index, row in df.iterrows():
-        # Assuming 1RM is most accurate on the very first repetition
-        estimated_1RM.append(row['Predicted Weights'][0])
-    return estimated_1RM
+    # Assuming 1RM is most accurate on the very first repetition
+    return df.groupby('SetNumber')['Predicted Weight'].nth(0).to_numpy()
 
-# Function to compute estimated 1RM
+# Function to compute estimated RIR
 def compute_estimated_rir(df):
-    estimated_rir = []
-    for index, row in df.iterrows():
-        # Verifying the accuracy of the second last repetition's RIR
-        estimated_rir.append(row['Predicted RIR'][-2])
-    return estimated_rir
+    # Verifying the accuracy of the second last repetition's RIR
+    return df.groupby('SetNumber')['Predicted RIR'].nth(-2).to_numpy()
 
-# Function to compute estimated 1RM
+# Function to compute speeds
 def compute_speeds(df):
-    estimated_speed = []
-    for index, row in df.iterrows():
-        # Taking the speed of the last repetition
-        estimated_speed.append(row['Speeds'][-1])
-    return estimated_speed
-
-
-# Compute estimated 1RM for each day
-day_1_1RM = compute_estimated_1RM(day_1_df)
-day_2_1RM = compute_estimated_1RM(day_2_df)
-day_3_1RM = compute_estimated_1RM(day_3_df)
-day_4_1RM = compute_estimated_1RM(day_4_df)
-
-
-# Plotting estimated 1RM for each day
-plt.figure(figsize=(10, 6))
-plt.plot(day_1_1RM, label='Day 1')
-plt.plot(day_2_1RM, label='Day 2')
-plt.plot(day_3_1RM, label='Day 3')
-plt.plot(day_4_1RM, label='Day 4')
-
-plt.title('Estimated 1RM Comparison by Day')
-plt.xlabel('Set')
-plt.ylabel('Estimated 1RM')
-plt.legend()
-
-# Adjusting the x-ticks to ensure they represent sets in whole numbers
-max_length = max(len(day_1_1RM), len(day_2_1RM), len(day_3_1RM), len(day_4_1RM))
-plt.xticks(np.arange(max_length), np.arange(1, max_length + 1))
-
-plt.show()
-
-
-# Compute estimated 1RM for each day
-day_1_rir = compute_estimated_rir(day_1_df)
-day_2_rir = compute_estimated_rir(day_2_df)
-day_3_rir = compute_estimated_rir(day_3_df)
-day_4_rir = compute_estimated_rir(day_4_df)
-
-# Plotting estimated RIR for each day
-plt.figure(figsize=(10, 6))
-plt.plot(day_1_rir, label='Day 1')
-plt.plot(day_2_rir, label='Day 2')
-plt.plot(day_3_rir, label='Day 3')
-plt.plot(day_4_rir, label='Day 4')
-
-plt.title('Estimated RIR Comparison by Day')
-plt.xlabel('Set')
-plt.ylabel('Estimated RIR')
-plt.legend()
-
-# Adjusting the x-ticks to ensure they represent sets in whole numbers
-max_length = max(len(day_1_rir), len(day_2_rir), len(day_3_rir), len(day_4_rir))
-plt.xticks(np.arange(max_length), np.arange(1, max_length + 1))
-
-plt.show()
-
-# Compute estimated 1RM for each day
-day_1_rir = compute_speeds(day_1_df)
-day_2_rir = compute_speeds(day_2_df)
-day_3_rir = compute_speeds(day_3_df)
-day_4_rir = compute_speeds(day_4_df)
-
-# Plotting estimated RIR for each day
-plt.figure(figsize=(10, 6))
-plt.plot(day_1_rir, label='Day 1')
-plt.plot(day_2_rir, label='Day 2')
-plt.plot(day_3_rir, label='Day 3')
-plt.plot(day_4_rir, label='Day 4')
-
-plt.title('Estimated Speed Comparison by Day')
-plt.xlabel('Set')
-plt.ylabel('Estimated Speed')
-plt.legend()
-
-# Adjusting the x-ticks to ensure they represent sets in whole numbers
-max_length = max(len(day_1_rir), len(day_2_rir), len(day_3_rir), len(day_4_rir))
-plt.xticks(np.arange(max_length), np.arange(1, max_length + 1))
-
-plt.show()
\ No newline at end of file
+    # Taking the speed of the last repetition
+    return df.groupby('SetNumber')['Speed'].nth(-1).to_numpy()
+
+
+# value per set, title and y label of each comparison
+COMPARISONS = {
+    '1rm': (compute_estimated_1RM, 'Estimated 1RM Comparison by Day', 'Estimated 1RM'),
+    'rir': (compute_estimated_rir, 'Estimated RIR Comparison by Day', 'Estimated RIR'),
+    'speed': (compute_speeds, 'Estimated Speed Comparison by Day', 'Estimated Speed'),
+}
+
+
+def plot_comparison(day_dfs, comparison):
+    '''
+    Plots one comparison (a key of COMPARISONS) of the {day: analysis table} days
+    '''
+    compute, title, y_label = COMPARISONS[comparison]
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    max_length = 0
+    for day, df in day_dfs.items():
+        for camera, camera_df in camera_groups(df):
+            values = compute(camera_df)
+            ax.plot(values, label=f'Day {day}{camera}')
+            max_length = max(max_length, len(values))
+
+    ax.set_title(title)
+    ax.set_xlabel('Set')
+    ax.set_ylabel(y_label)
+    ax.legend()
+
+    # Adjusting the x-ticks to ensure they represent sets in whole numbers
+    ax.set_xticks(np.arange(max_length), np.arange(1, max_length + 1))
+    return fig
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the comparison charts of every day in an analysis folder")
+    parser.add_argument('--analysis-folder', default='analysis_results', help="folder of the day_N_analysis tables")
+    args = parser.parse_args()
+
+    # Load the day analysis tables, one row per repetition
+    day_dfs = {day: load_table(path) for day, path in find_day_tables(args.analysis_folder).items()}
+    for comparison in COMPARISONS:
+        plot_comparison(day_dfs, comparison)
+        plt.show()
@@ -0,0 +1,146 @@
+'''
+This script writes every chart to image files without opening any windows, e.g. for a nightly report.
+
+For each analysis folder (one per athlete) it renders the singular chart of every day and every comparison chart
+of all of the days, as png and/or svg files. Matplotlib uses the non interactive Agg backend and the figures are
+rendered by a pool of worker processes, each worker loads only the analysis tables its figure needs.
+
+A chart cache (chart_cache.json in the output folder) keeps a hash of the analysis tables behind each figure, only
+figures whose tables have changed are rendered again. A new day renders that day's chart and the comparison charts.
+
+    python -m charting.render_charts --analysis-folder analysis_results --output-folder charts --format png svg
+'''
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from barbell_tracking.manifest import file_sha1
+from barbell_tracking.rep_table import load_table
+from charting.comparative_day_charts import COMPARISONS, find_day_tables, plot_comparison
+from charting.singular_day_charts import plot_day
+
+# bump when the figures change, every chart is then rendered again
+CHART_VERSION = 1
+
+
+def chart_jobs(analysis_folders, output_folder):
+    '''
+    Returns (kind, name, {day: table path}, output path without extension) for every figure to render
+    '''
+    jobs = []
+    for analysis_folder in analysis_folders:
+        day_tables = find_day_tables(analysis_folder)
+        # the charts of each athlete go into a folder named after their analysis folder
+        athlete_folder = os.path.join(output_folder, os.path.basename(os.path.normpath(analysis_folder)))
+        for day, path in day_tables.items():
+            jobs.append(('day', day, {day: path}, os.path.join(athlete_folder, f"day_{day}")))
+        if day_tables:
+            for comparison in COMPARISONS:
+                jobs.append(('comparison', comparison, day_tables, os.path.join(athlete_folder, f"comparison_{comparison}")))
+    return jobs
+
+
+def render_chart(kind, name, day_tables, output_base, formats=('png',), dpi=100):
+    '''
+    Renders one figure to each of the formats, returns the files written
+    '''
+    day_dfs = {day: load_table(path) for day, path in day_tables.items()}
+    fig = plot_day(day_dfs[name], name) if kind == 'day' else plot_comparison(day_dfs, name)
+
+    os.makedirs(os.path.dirname(output_base), exist_ok=True)
+    paths = []
+    for extension in formats:
+        path = f"{output_base}.{extension}"
+        fig.savefig(path, dpi=dpi)
+        paths.append(path)
+    # figures are not shown, close them so a worker does not keep every figure it rendered
+    plt.close(fig)
+    return paths
+
+
+def chart_key(kind, name, day_tables, dpi, table_hashes):
+    '''
+    Hash of everything a figure depends on, the contents of its analysis tables and how it is rendered
+    '''
+    text = json.dumps({'version': CHART_VERSION, 'kind': kind, 'name': name, 'dpi': dpi,
+                       'tables': {str(day): table_hashes[path] for day, path in day_tables.items()}}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def load_chart_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_chart_cache(path, cache):
+    # write to a temporary file first so an interrupted run can not leave a broken cache
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def render_charts(analysis_folders, output_folder='charts', formats=('png',), workers=1, dpi=100, force=False):
+    '''
+    Renders the charts that are not up to date (all of them with force), returns the files written
+    '''
+    jobs = chart_jobs(analysis_folders, output_folder)
+    cache_path = os.path.join(output_folder, 'chart_cache.json')
+    cache = load_chart_cache(cache_path)
+
+    # every table is hashed once, however many figures it is part of
+    table_hashes = {path: file_sha1(path) for job in jobs for path in job[2].values()}
+    keys = {}
+    pending = []
+    for job in jobs:
+        output_base = job[3]
+        keys[output_base] = chart_key(*job[:3], dpi, table_hashes)
+        # a format that was not asked for before has no file yet, so the figure is rendered again
+        up_to_date = (not force and cache.get(output_base) == keys[output_base]
+                      and all(os.path.exists(f"{output_base}.{extension}") for extension in formats))
+        if not up_to_date:
+            pending.append(job)
+
+    written = []
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(render_chart, *job, formats, dpi): job[3] for job in pending}
+            for future in as_completed(futures):
+                written.extend(future.result())
+                cache[futures[future]] = keys[futures[future]]
+    else:
+        for job in pending:
+            written.extend(render_chart(*job, formats, dpi))
+            cache[job[3]] = keys[job[3]]
+
+    os.makedirs(output_folder, exist_ok=True)
+    save_chart_cache(cache_path, cache)
+    print(f"{len(pending)} of {len(jobs)} charts rendered, {len(jobs) - len(pending)} up to date")
+    return sorted(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render every day and comparison chart to image files")
+    parser.add_argument('--analysis-folder', nargs='+', default=['analysis_results'],
+                        help="folders of day_N_analysis tables, one per athlete")
+    parser.add_argument('--output-folder', default='charts', help="folder the charts are written to")
+    parser.add_argument('--format', nargs='+', choices=['png', 'svg'], default=['png'], help="image formats to write")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes rendering the charts")
+    parser.add_argument('--dpi', type=int, default=100, help="resolution of the png files")
+    parser.add_argument('--force', action='store_true', help="render every chart, even the ones that are up to date")
+    args = parser.parse_args()
+
+    written = render_charts(args.analysis_folder, args.output_folder, tuple(args.format), args.workers, args.dpi,
+                            force=args.force)
+    print(f"{len(written)} chart files written to {args.output_folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,49 @@
-import pandas as pd
-import ast
-import matplotlib.pyplot as plt
-
+'''
+This script shows a breakdown of all the repetitions within a singular day, one figure per day with the speeds,
+predicted RIR, predicted percentages and predicted weights of each set.
 
-for i in range(1,5):
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(f'~/Downloads/main_functionalityv4/analysis_results/day_{i}_analysis.csv')
+plot_day builds the figure of one day's analysis table, render_charts.py uses it to write every day's figure to
+files. Run on its own the script shows the figures of every day in an analysis folder.
+'''
 
-    # Function to convert string representation of list to list
-    def convert_to_list(s):
-        return ast.literal_eval(s)
+import argparse
+import matplotlib.pyplot as plt
+from barbell_tracking.rep_table import load_table
+from charting.comparative_day_charts import camera_groups, find_day_tables
 
-    # Apply the conversion function to relevant columns
-    df[f'Day {i} Speeds'] = df['Speeds'].apply(convert_to_list)
-    df[f'Day {i} Predicted RIR'] = df['Predicted RIR'].apply(convert_to_list)
-    df[f'Day {i} Predicted Percentages'] = df['Predicted Percentages'].apply(convert_to_list)
-    df[f'Day {i} Predicted Weights'] = df['Predicted Weights'].apply(convert_to_list)
 
+def plot_day(df, day):
     # Create a single figure and a set of subplots
     fig, axs = plt.subplots(2, 2, figsize=(15, 10))  # 2x2 grid of plots, adjust size as needed
 
     # Flatten the array of axes for easier iteration
     axs = axs.flatten()
 
-    # Titles for each subplot
-    titles = [f'Day {i} Speeds', f'Day {i} Predicted RIR', f'Day {i} Predicted Percentages', f'Day {i} Predicted Weights']
+    # Titles for each subplot and the column each one plots
+    titles = {f'Day {day} Speeds': 'Speed', f'Day {day} Predicted RIR': 'Predicted RIR',
+              f'Day {day} Predicted Percentages': 'Predicted Percentage', f'Day {day} Predicted Weights': 'Predicted Weight'}
 
     # Loop through each subplot and plot the corresponding data
-    for ax, title in zip(axs, titles):
-        for index, row in df.iterrows():
-            ax.plot(row[title][:10], label=f'Set {index+1}')  # plot first 10 repetitions only
+    for ax, (title, column) in zip(axs, titles.items()):
+        for camera, camera_df in camera_groups(df):
+            for set_number, set_df in camera_df.groupby('SetNumber'):
+                ax.plot(set_df[column].to_numpy()[:10], label=f'Set {set_number}{camera}')  # plot first 10 repetitions only
         ax.set_title(title)
         ax.set_xlabel('Repetitions')
         ax.legend()
 
     # Adjust layout to prevent overlap
-    plt.tight_layout()
+    fig.tight_layout()
+    return fig
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the charts of every day in an analysis folder")
+    parser.add_argument('--analysis-folder', default='analysis_results', help="folder of the day_N_analysis tables")
+    args = parser.parse_args()
 
-    # Display the plots
-    plt.show()
+    for day, path in find_day_tables(args.analysis_folder).items():
+        # Load the day's analysis table, one row per repetition
+        plot_day(load_table(path), day)
+        # Display the plots
+        plt.show()
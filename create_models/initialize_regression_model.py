@@ -10,18 +10,15 @@ RIR vs Percentage, Percentage vs Speed, Speed vs RIR.
 
 import statsmodels.api as sm
 import numpy as np
-import pandas as pd
 import warnings
 import matplotlib.pyplot as plt
+from barbell_tracking.rep_table import load_rep_table
 
 # Suppress all warnings
 warnings.filterwarnings('ignore')
 
-# Read the CSV file into a DataFrame
-video_df = pd.read_csv("video_info_sorted.csv")
-
-# Convert 'AverageSpeeds' string to a list of floats
-video_df['AverageSpeeds'] = video_df['AverageSpeeds'].apply(lambda x: [float(speed) for speed in x.strip('[]').split(', ')])
+# Read the rep table into a DataFrame, one row per repetition
+video_df = load_rep_table("rep_table.npz")
 
 # Filter results for day 0
 day_0_results = video_df[video_df['SessionNumber'] == 0]
@@ -38,8 +35,8 @@ for set_number, (weight, reps) in weights.items():
 # Calculate percentage of each weight with respect to 120 kg
 percentages = [(weight / 120) * 100 for weight, _ in weights.values()]
 
-# Extract the first value from the list of average speeds for each set
-average_speeds = [speeds[0] for speeds in day_0_results['AverageSpeeds']]
+# Extract the first repetition of each set
+average_speeds = day_0_results[day_0_results['Rep'] == 1].sort_values(['Camera', 'SetNumber'])['Speed'].tolist()
 
 # Weights, rirs, and average_speeds are numpy arrays
 weights = np.array([70, 90, 100, 112.5, 120])
@@ -3,91 +3,317 @@ This script uses most of the functionality derived from the initialize_regressio
 On top of that it tries to compare the results of days 1 - 4 against the regression models created by day 0 (test day)
 
 The results of this script are sent back in the form of a tuple of 4 lists, Estimated RIR, Estimated 1RM, Estimated % and speed. 
+
+For many repetitions at once predict_batch takes a numpy array of speeds and analyze_rep_table a whole rep table,
+both work straight from the fitted coefficients in one vectorised pass.
+
+The fitted coefficients and their diagnostics are cached in a small json file keyed by a hash of the training data,
+when the training data has not changed the models are not fitted again and statsmodels is never imported.
+ModelAnalysis.from_cache loads a cache without reading the rep table at all, for prediction only runs, pandas is
+only imported once a rep table is read.
+
+With only five training points the predictions are uncertain, prediction_intervals gives analytic (t distribution)
+or residual bootstrap intervals for a batch of speeds and analyze_rep_table can add them as columns. The bootstrap
+refits every resample at once with numpy instead of one statsmodels fit per resample.
+
+One ModelAnalysis is one athlete's profile from one baseline (test) session, model_registry.py keeps the profiles
+of many athletes and baselines.
 '''
 
-import statsmodels.api as sm
+import hashlib
+import json
+import os
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import warnings
 
+# bump when the cached contents change, older caches are then fitted again
+MODEL_CACHE_VERSION = 1
+
+# the original test day, (weight kg, reps to failure) of each set, and the one rep max the percentages are of
+BASELINE_LOADS = [(70, 22), (90, 10), (100, 6), (112.5, 2), (120, 1)]
+BASELINE_ONE_REP_MAX = 120
+
+# athlete of rep tables without an Athlete column
+DEFAULT_ATHLETE = 'default'
+
+# each model's independent and dependent training data
+MODELS = {
+    's_vs_rir': ('original_speeds', 'rirs'),
+    'rir_vs_percentage': ('rirs', 'percentages'),
+    's_vs_percentage': ('original_speeds', 'percentages'),
+}
+
 class ModelAnalysis:
-    def __init__(self, csv_file):
-        self.csv_file = csv_file
+    def __init__(self, csv_file, cache_file='model_cache.json', athlete=None, baseline_session=0,
+                 baseline_loads=BASELINE_LOADS, one_rep_max=BASELINE_ONE_REP_MAX):
+        self.csv_file = csv_file # rep table (.npz or its csv copy) or a DataFrame, a legacy video_info_sorted.csv is converted
+        self.cache_file = cache_file # fitted coefficients cache, None to always fit
+        self.athlete = athlete # only used when the rep table has an Athlete column
+        self.baseline_session = baseline_session
+        self.baseline_loads = baseline_loads # (weight, reps) of each baseline set in SetNumber order
+        self.one_rep_max = one_rep_max
         self.video_df = None
         self.day_0_results = None
-        self.model_s_vs_percentage = None
+        self.model_s_vs_percentage = None # statsmodels results, only set when the models were fitted in this run
         self.model_s_vs_rir = None
         self.model_rir_vs_percentage = None
+        self.coefficients = {} # (intercept, slope) of each fitted model
+        self.diagnostics = {} # r squared, p values, standard errors etc. of each fitted model
         self.load_and_prepare_data()
-        self.train_models()
+        if not self.load_cache():
+            self.train_models()
+            self.save_cache()
+
+    @classmethod
+    def from_cache(cls, cache_file='model_cache.json'):
+        '''
+        Builds a prediction only ModelAnalysis from a cache file, the rep table is not read
+        '''
+        with open(cache_file) as f:
+            analysis = cls.from_cache_data(json.load(f))
+        analysis.cache_file = cache_file
+        return analysis
+
+    @classmethod
+    def from_cache_data(cls, cache):
+        '''
+        Builds a prediction only ModelAnalysis from the contents of a cache file (see cache_data)
+        '''
+        analysis = cls.__new__(cls)
+        analysis.csv_file = None
+        analysis.cache_file = None
+        analysis.athlete = cache.get('athlete')
+        analysis.baseline_session = cache.get('baseline_session', 0)
+        analysis.baseline_loads = [tuple(load) for load in cache.get('baseline_loads', BASELINE_LOADS)]
+        analysis.one_rep_max = cache.get('one_rep_max', BASELINE_ONE_REP_MAX)
+        analysis.video_df = None
+        analysis.day_0_results = None
+        analysis.model_s_vs_percentage = None
+        analysis.model_s_vs_rir = None
+        analysis.model_rir_vs_percentage = None
+        analysis.apply_cache(cache)
+        return analysis
 
     def load_and_prepare_data(self):
-        self.video_df = pd.read_csv(self.csv_file)
-        self.video_df['AverageSpeeds'] = self.video_df['AverageSpeeds'].apply(
-            lambda x: [float(speed) for speed in x.strip('[]').split(', ')])
-        self.day_0_results = self.video_df[self.video_df['SessionNumber'] == 0]
+        # only imported when the rep table is read, prediction only runs from a cache never import pandas
+        import pandas as pd
+        from barbell_tracking.rep_table import load_rep_table
 
-        # Original dataset speeds, weights, and percentages for model training
-        self.original_speeds = np.array([speeds[0] for speeds in self.day_0_results['AverageSpeeds']])
-        weights = np.array([70, 90, 100, 112.5, 120])
-        self.rirs = np.array([abs(1 - reps) for reps in [22, 10, 6, 2, 1]])
-        self.percentages = np.array([(weight / 120) * 100 for weight in weights])
+        self.video_df = self.csv_file if isinstance(self.csv_file, pd.DataFrame) else load_rep_table(self.csv_file)
+        athlete_df = self.video_df
+        if self.athlete is not None and 'Athlete' in athlete_df.columns:
+            athlete_df = athlete_df[athlete_df['Athlete'] == self.athlete]
+        self.day_0_results = athlete_df[athlete_df['SessionNumber'] == self.baseline_session]
+
+        # Original dataset speeds (first rep of each set), weights, and percentages for model training
+        first_reps = self.day_0_results[self.day_0_results['Rep'] == 1].sort_values(['Camera', 'SetNumber'])
+        if len(first_reps) != len(self.baseline_loads):
+            raise ValueError(f"Baseline session {self.baseline_session} of athlete {self.athlete} has "
+                             f"{len(first_reps)} sets, {len(self.baseline_loads)} baseline loads were given")
+        self.original_speeds = first_reps['Speed'].to_numpy()
+        weights = np.array([weight for weight, _ in self.baseline_loads])
+        self.rirs = np.array([abs(1 - reps) for _, reps in self.baseline_loads])
+        self.percentages = weights / self.one_rep_max * 100
 
     def train_models(self):
+        # only imported when the models have to be fitted, cached runs never need it
+        import statsmodels.api as sm
+
         speeds_with_const = sm.add_constant(self.original_speeds)
         rirs_with_const = sm.add_constant(self.rirs)
         self.model_s_vs_rir = sm.OLS(self.rirs, speeds_with_const).fit()
         self.model_rir_vs_percentage = sm.OLS(self.percentages, rirs_with_const).fit()
         self.model_s_vs_percentage = sm.OLS(self.percentages, speeds_with_const).fit()
 
+        for name, (x_name, _) in MODELS.items():
+            model = getattr(self, f'model_{name}')
+            x = getattr(self, x_name)
+            self.coefficients[name] = tuple(float(p) for p in model.params)
+            self.diagnostics[name] = {
+                'r_squared': float(model.rsquared),
+                'p_values': [float(p) for p in model.pvalues],
+                'std_errors': [float(e) for e in model.bse],
+                'nobs': int(model.nobs),
+                'df_resid': float(model.df_resid),
+                'mse_resid': float(model.mse_resid),
+                'x_mean': float(np.mean(x)),
+                'sxx': float(np.sum((x - np.mean(x)) ** 2)),
+            }
+
+    def training_data_hash(self):
+        training = {'version': MODEL_CACHE_VERSION,
+                    'speeds': self.original_speeds.tolist(),
+                    'rirs': self.rirs.tolist(),
+                    'percentages': self.percentages.tolist()}
+        return hashlib.sha1(json.dumps(training, sort_keys=True).encode()).hexdigest()
+
+    def apply_cache(self, cache):
+        self.original_speeds = np.array(cache['training']['speeds'])
+        self.rirs = np.array(cache['training']['rirs'])
+        self.percentages = np.array(cache['training']['percentages'])
+        self.coefficients = {name: tuple(params) for name, params in cache['coefficients'].items()}
+        self.diagnostics = cache['diagnostics']
+
+    def load_cache(self):
+        '''
+        Uses the cached coefficients when they were fitted on the same training data, returns False otherwise
+        '''
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return False
+        with open(self.cache_file) as f:
+            cache = json.load(f)
+        if cache.get('data_hash') != self.training_data_hash():
+            return False
+        self.apply_cache(cache)
+        return True
+
+    def cache_data(self):
+        return {
+            'data_hash': self.training_data_hash(),
+            'athlete': self.athlete,
+            'baseline_session': self.baseline_session,
+            'baseline_loads': [list(load) for load in self.baseline_loads],
+            'one_rep_max': self.one_rep_max,
+            'training': {'speeds': self.original_speeds.tolist(),
+                         'rirs': self.rirs.tolist(),
+                         'percentages': self.percentages.tolist()},
+            'coefficients': self.coefficients,
+            'diagnostics': self.diagnostics,
+        }
+
+    def save_cache(self):
+        if self.cache_file is None:
+            return
+        with open(self.cache_file, 'w') as f:
+            json.dump(self.cache_data(), f, indent=1)
+
     def predict_rir_from_speed(self, speed):
-        speed_with_const = sm.add_constant(np.array([speed]), has_constant='add')
-        predicted_rir = self.model_s_vs_rir.predict(speed_with_const)[0]
-        return predicted_rir
+        intercept, slope = self.coefficients['s_vs_rir']
+        return intercept + slope * speed
     
     def predict_percentage_from_speed(self, speed):
-        speed_with_const = sm.add_constant(np.array([speed]), has_constant='add')
-        predicted_percentage = self.model_s_vs_percentage.predict(speed_with_const)[0]
-        return predicted_percentage
+        intercept, slope = self.coefficients['s_vs_percentage']
+        return intercept + slope * speed
 
     def predict_percentage_from_rir(self, rir):
-        rir_with_const = sm.add_constant(np.array([rir]), has_constant='add')
-        predicted_percentage = self.model_rir_vs_percentage.predict(rir_with_const)[0]
-        return predicted_percentage
+        intercept, slope = self.coefficients['rir_vs_percentage']
+        return intercept + slope * rir
 
     def calculate_weight_from_percentage(self, percentage, weight=100):
         print(weight/percentage)
         return weight * (weight/percentage)
 
-    def analyze_new_speeds(self, new_speeds):
-        speeds = []
-        predicted_rirs = []
-        predicted_percentages = []
-        predicted_weights = []
-        for speed in new_speeds:
-            predicted_rir = self.predict_rir_from_speed(speed)
-            predicted_percentage = self.predict_percentage_from_speed(speed)
-            estimated_weight = self.calculate_weight_from_percentage(predicted_percentage)
-            speeds.append(speed)
-            predicted_rirs.append(predicted_rir)
-            predicted_percentages.append(predicted_percentage)
-            predicted_weights.append(estimated_weight)
-
+    def predict_batch(self, speeds, weight=100):
+        '''
+        Vectorised version of analyze_new_speeds, takes an array of speeds and returns arrays of
+        speeds, predicted RIR, predicted percentages and predicted weights
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        intercept, slope = self.coefficients['s_vs_rir']
+        predicted_rirs = intercept + slope * speeds
+        intercept, slope = self.coefficients['s_vs_percentage']
+        predicted_percentages = intercept + slope * speeds
+        # same calculation as calculate_weight_from_percentage, without printing every value
+        predicted_weights = weight * (weight / predicted_percentages)
         return speeds, predicted_rirs, predicted_percentages, predicted_weights
 
+    def prediction_intervals(self, speeds, method='analytic', level=0.95, n_bootstrap=2000, seed=None):
+        '''
+        Prediction intervals of the speed vs rir and speed vs percentage models for an array of speeds,
+        returns {model name: (lower, upper)}. method is 'analytic' or 'bootstrap' (residual bootstrap, needs the
+        training data so it is not available for an OnlineProfile)
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        intervals = {}
+        for name in ('s_vs_rir', 's_vs_percentage'):
+            intercept, slope = self.coefficients[name]
+            predicted = intercept + slope * speeds
+            if method == 'analytic':
+                # only needed for the t quantile
+                from scipy import stats
+
+                diagnostics = self.diagnostics[name]
+                t = stats.t.ppf((1 + level) / 2, diagnostics['df_resid'])
+                std_error = np.sqrt(diagnostics['mse_resid'] * (1 + 1 / diagnostics['nobs']
+                                                                + (speeds - diagnostics['x_mean']) ** 2 / diagnostics['sxx']))
+                intervals[name] = (predicted - t * std_error, predicted + t * std_error)
+            elif method == 'bootstrap':
+                intervals[name] = self.bootstrap_interval(name, speeds, level, n_bootstrap, np.random.default_rng(seed))
+            else:
+                raise ValueError(f"Unknown interval method {method}, use 'analytic' or 'bootstrap'")
+        return intervals
+
+    def bootstrap_interval(self, name, speeds, level, n_bootstrap, rng):
+        '''
+        Residual bootstrap, all resamples are refitted in one matrix product
+        '''
+        x_name, y_name = MODELS[name]
+        x = getattr(self, x_name, None)
+        y = getattr(self, y_name, None)
+        if x is None or y is None:
+            raise ValueError("Bootstrap intervals need the training data of the model")
+        n = len(x)
+        intercept, slope = self.coefficients[name]
+        fitted = intercept + slope * x
+        # residuals scaled up for the two fitted parameters
+        residuals = (y - fitted) * np.sqrt(n / (n - 2))
+
+        resampled_y = fitted + residuals[rng.integers(0, n, (n_bootstrap, n))]
+        x_centred = x - x.mean()
+        slopes = resampled_y @ x_centred / np.sum(x_centred ** 2)
+        intercepts = resampled_y.mean(axis=1) - slopes * x.mean()
+
+        # each resample's prediction plus a resampled residual for the new observation
+        predictions = (intercepts[:, None] + slopes[:, None] * speeds[None, :]
+                       + residuals[rng.integers(0, n, (n_bootstrap, len(speeds)))])
+        lower, upper = np.quantile(predictions, [(1 - level) / 2, (1 + level) / 2], axis=0)
+        return lower, upper
+
+    def interval_columns(self, speeds, method='analytic', level=0.95, weight=100, **options):
+        '''
+        Lower and upper columns of the predicted RIR, percentage and weight for an array of speeds
+        '''
+        intervals = self.prediction_intervals(speeds, method, level, **options)
+        rir_lower, rir_upper = intervals['s_vs_rir']
+        percentage_lower, percentage_upper = intervals['s_vs_percentage']
+        return {
+            'Predicted RIR Lower': rir_lower,
+            'Predicted RIR Upper': rir_upper,
+            'Predicted Percentage Lower': percentage_lower,
+            'Predicted Percentage Upper': percentage_upper,
+            # the weight falls as the percentage rises, so its lower bound comes from the upper percentage
+            'Predicted Weight Lower': weight * (weight / percentage_upper),
+            'Predicted Weight Upper': weight * (weight / percentage_lower),
+        }
+
+    def analyze_rep_table(self, rep_df, speed_column='Speed', intervals=None, level=0.95, **interval_options):
+        '''
+        Returns a copy of the rep table (any table with a speed column, e.g. a day, set or whole season of reps)
+        with the Predicted RIR, Predicted Percentage and Predicted Weight columns added.
+        intervals ('analytic' or 'bootstrap') adds the lower and upper bounds of each prediction as well
+        '''
+        speeds = rep_df[speed_column].to_numpy()
+        _, predicted_rirs, predicted_percentages, predicted_weights = self.predict_batch(speeds)
+        columns = {
+            'Predicted RIR': predicted_rirs,
+            'Predicted Percentage': predicted_percentages,
+            'Predicted Weight': predicted_weights,
+        }
+        if intervals is not None:
+            columns.update(self.interval_columns(speeds, intervals, level, **interval_options))
+        return rep_df.assign(**columns)
+
+    def analyze_new_speeds(self, new_speeds):
+        speeds, predicted_rirs, predicted_percentages, predicted_weights = self.predict_batch(new_speeds)
+        return speeds.tolist(), predicted_rirs.tolist(), predicted_percentages.tolist(), predicted_weights.tolist()
+
         
 # Example of using the class with new speeds
 if __name__ == "__main__":
-    analysis = ModelAnalysis("video_info_sorted.csv")
-    # Read the CSV file into a DataFrame
-    video_df = pd.read_csv("video_info_sorted.csv")
-
-    # Convert 'AverageSpeeds' string to a list of floats
-    video_df['AverageSpeeds'] = video_df['AverageSpeeds'].apply(lambda x: [float(speed) for speed in x.strip('[]').split(', ')])
+    analysis = ModelAnalysis("rep_table.npz")
 
-    # Filter results for day 0
-    day_1_results = video_df[video_df['SessionNumber'] == 1]
-    # Extract the first value from the list of average speeds for each set
-    average_speeds = [speeds[4] for speeds in day_1_results['AverageSpeeds']]
+    # Filter results for day 1
+    day_1_results = analysis.video_df[analysis.video_df['SessionNumber'] == 1]
+    # Extract the fifth repetition of each set
+    average_speeds = day_1_results[day_1_results['Rep'] == 5]['Speed'].to_numpy()
     analysis.analyze_new_speeds(average_speeds)
@@ -1,70 +1,73 @@
 '''
-Using the analysis_factory.py script, this script predicts each of the results from day's 1 - 4 against
-the regression model as created from the day0 results. 
+Using the analysis_factory.py script, this script predicts each of the results from the days after the test day
+against the regression model as created from the day0 results.
 
-The Predicted RIR, Speed & percentages are then stored in analysis files for each day.
+The Predicted RIR, Speed & percentages, with the lower and upper bounds of their 95% prediction intervals, are then
+stored in analysis tables for each day, one row per repetition (day_N_analysis.npz with a day_N_analysis.csv copy,
+see barbell_tracking/rep_table.py).
 
+The rep table is read once and every day, set and repetition is predicted in one vectorised pass, the days are
+found from the SessionNumber column rather than fixed to days 1 - 4. Predicting is a few milliseconds even for
+hundreds of sessions, nearly all of the time goes to compressing and writing the per day files, so these are
+written by several processes (and the csv copies can be left out).
 '''
 
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 from create_models.model_analysis import ModelAnalysis
-import pandas as pd
-
-analysis = ModelAnalysis("video_info_sorted.csv")
-# Read the CSV file into a DataFrame
-video_df = pd.read_csv("video_info_sorted.csv")
-
-# Convert 'AverageSpeeds' string to a list of floats
-video_df['AverageSpeeds'] = video_df['AverageSpeeds'].apply(lambda x: [float(speed) for speed in x.strip('[]').split(', ')])
-
-# Filter results for day 0
-for i in range(1, 5):
-    day_results = video_df[video_df['SessionNumber'] == i]
-    # Extract the first value from the list of average speeds for each set
-    average_speeds = day_results['AverageSpeeds']
-
-    sets_dict = {f"Set {i+1}": speed for i, speed in enumerate(average_speeds)}
-
-    # Find the length of the longest list
-    max_length = max(len(lst) for lst in sets_dict.values())
-
-    # Fill missing values with NaN
-    for key in sets_dict:
-        if len(sets_dict[key]) < max_length:
-            sets_dict[key].extend([None] * (max_length - len(sets_dict[key])))
-
-    # Convert dictionary to DataFrame
-    df = pd.DataFrame(sets_dict)
-
-    new_column_names = {old_col: f'Rep {i+1}' for i, old_col in enumerate(df.columns)}
-    df.rename(columns=new_column_names, inplace=True)
-
-    sets_dict_modified = df.to_dict()
-    def remove_nan_values_nested(d):
-        return {k: {k2: v2 for k2, v2 in v.items() if v2 == v2} for k, v in d.items()}
-
-    # Apply function to remove NaN values
-    sets_dict_modified = remove_nan_values_nested(sets_dict_modified)
-
-    # Convert to desired format
-    desired_data = {key: list(value.values()) for key, value in sets_dict_modified.items()}
-    upper_dict = {}
-    dict_of_vals = {}
-    t_list = []
-
-    for v in desired_data:
-        speeds, predicted_rirs, predicted_percentages, predicted_weights = analysis.analyze_new_speeds(desired_data[v])
-        print(v.split(" ")[1])
-        rep_value = f"Set {v.split(' ')[1]}"
-
-        dict_of_vals = {
-                        'Speeds': speeds,
-                        'Predicted RIR': predicted_rirs,
-                        'Predicted Percentages': predicted_percentages,
-                        'Predicted Weights': predicted_weights,
-
-                    }
-        
-        upper_dict[rep_value]= dict_of_vals
-
-    df = pd.DataFrame(upper_dict)
-    df.T.to_csv(f"day_{i}_analysis.csv")
\ No newline at end of file
+from barbell_tracking.rep_table import save_table
+
+ANALYSIS_COLUMNS = ['SessionNumber', 'SetNumber', 'Camera', 'Rep', 'Speed', 'Predicted RIR', 'Predicted Percentage', 'Predicted Weight',
+                    'Predicted RIR Lower', 'Predicted RIR Upper', 'Predicted Percentage Lower', 'Predicted Percentage Upper',
+                    'Predicted Weight Lower', 'Predicted Weight Upper']
+
+
+def analyse_days(analysis, intervals='analytic'):
+    '''
+    Predictions for every repetition after the baseline session, sorted by day, set, camera and repetition
+    '''
+    video_df = analysis.video_df
+    day_results = video_df[video_df['SessionNumber'] != analysis.baseline_session]
+    day_results = day_results.sort_values(['SessionNumber', 'SetNumber', 'Camera', 'Rep'], kind='stable')
+    analysed = analysis.analyze_rep_table(day_results, intervals=intervals)
+    columns = [column for column in ANALYSIS_COLUMNS if column in analysed.columns]
+    return analysed[columns].reset_index(drop=True)
+
+
+def write_days(analysed, output_folder='.', workers=1, csv=True):
+    '''
+    Writes one day_N_analysis table per session, returns the paths written
+    '''
+    os.makedirs(output_folder, exist_ok=True)
+    days = {os.path.join(output_folder, f"day_{session}_analysis.npz"): day_df.reset_index(drop=True)
+            for session, day_df in analysed.groupby('SessionNumber', sort=True)}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            writes = [executor.submit(save_table, day_df, path, csv) for path, day_df in days.items()]
+            for write in writes:
+                write.result()
+    else:
+        for path, day_df in days.items():
+            save_table(day_df, path, csv)
+    return list(days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict RIR, percentage and weight of every day after the test day")
+    parser.add_argument('--rep-table', default='rep_table.npz', help="rep table written by video_analysis_factory.py")
+    parser.add_argument('--output-folder', default='analysis_results', help="folder of the day_N_analysis tables, the charting scripts read them from there")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes writing the day tables")
+    parser.add_argument('--no-csv', action='store_true', help="only write the .npz tables, no csv copies")
+    parser.add_argument('--intervals', choices=['analytic', 'bootstrap', 'none'], default='analytic',
+                        help="prediction intervals added to the tables")
+    args = parser.parse_args()
+
+    analysis = ModelAnalysis(args.rep_table)
+    analysed = analyse_days(analysis, None if args.intervals == 'none' else args.intervals)
+    for path in write_days(analysed, args.output_folder, args.workers, not args.no_csv):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+'''
+This script keeps the load velocity profiles of many athletes, one ModelAnalysis per athlete and baseline session.
+
+Every athlete can be tested more than once (a new baseline session whenever their strength has changed), the
+baselines are described in a json file:
+
+    {"malachy": {"0": {"loads": [[70, 22], [90, 10], [100, 6], [112.5, 2], [120, 1]], "one_rep_max": 120}}}
+
+with the (weight kg, reps to failure) of each baseline set in SetNumber order. Without a baselines file every
+athlete of the rep table uses session 0 with the original test day loads. Rep tables without an Athlete column
+belong to a single athlete called 'default'.
+
+The profiles are fitted in parallel, each profile is cached in its own json file (see model_analysis.py) so only
+new or changed baselines are fitted again. A rep table spanning many athletes and sessions is analysed with the
+latest baseline of each athlete at or before the session of each repetition.
+'''
+
+import argparse
+import bisect
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from create_models.model_analysis import ModelAnalysis, BASELINE_LOADS, BASELINE_ONE_REP_MAX, DEFAULT_ATHLETE
+from barbell_tracking.rep_table import load_rep_table, save_table
+
+
+def athlete_column(rep_df):
+    if 'Athlete' in rep_df.columns:
+        return rep_df['Athlete'].astype(str)
+    return pd.Series(DEFAULT_ATHLETE, index=rep_df.index)
+
+
+def load_baselines(path):
+    '''
+    Reads a baselines file into {athlete: {baseline session: {'loads': [(weight, reps), ...], 'one_rep_max': kg}}}
+    '''
+    with open(path) as f:
+        baselines = json.load(f)
+    return {str(athlete): {int(session): {'loads': [tuple(load) for load in baseline['loads']],
+                                          'one_rep_max': baseline['one_rep_max']}
+                           for session, baseline in sessions.items()}
+            for athlete, sessions in baselines.items()}
+
+
+def default_baselines(rep_df):
+    '''
+    Every athlete of the rep table with the original test day as their only baseline
+    '''
+    return {athlete: {0: {'loads': BASELINE_LOADS, 'one_rep_max': BASELINE_ONE_REP_MAX}}
+            for athlete in athlete_column(rep_df).unique()}
+
+
+def profile_cache_file(cache_folder, athlete, baseline_session):
+    if cache_folder is None:
+        return None
+    safe_athlete = re.sub(r'[^A-Za-z0-9_-]', '_', athlete)
+    return os.path.join(cache_folder, f"{safe_athlete}_{baseline_session}.json")
+
+
+def fit_profile(baseline_df, athlete, baseline_session, loads, one_rep_max, cache_file):
+    '''
+    Fits (or loads from its cache) one profile, returns its cache contents so only a small dict leaves the worker
+    '''
+    analysis = ModelAnalysis(baseline_df, cache_file=cache_file, athlete=athlete, baseline_session=baseline_session,
+                             baseline_loads=loads, one_rep_max=one_rep_max)
+    return analysis.cache_data()
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.profiles = {} # (athlete, baseline session) -> ModelAnalysis
+        self.sessions = {} # athlete -> sorted baseline sessions
+        self.skipped = [] # (athlete, baseline session, reason) of the baselines no profile could be fitted for
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def __getitem__(self, key):
+        return self.profiles[key]
+
+    def add(self, analysis):
+        key = (analysis.athlete, analysis.baseline_session)
+        if key not in self.profiles:
+            bisect.insort(self.sessions.setdefault(analysis.athlete, []), analysis.baseline_session)
+        self.profiles[key] = analysis
+
+    @classmethod
+    def build(cls, rep_df, baselines=None, workers=1, cache_folder='model_cache'):
+        '''
+        Fits a profile for every athlete and baseline session, workers > 1 fits them in separate processes.
+        Baselines without (matching) data in the rep table are skipped and listed in skipped instead of failing the
+        whole build, the rows of those athletes get no predictions as for unknown athletes
+        '''
+        if baselines is None:
+            baselines = default_baselines(rep_df)
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+
+        registry = cls()
+        athletes = athlete_column(rep_df)
+        jobs = []
+        for athlete, sessions in baselines.items():
+            for baseline_session, baseline in sessions.items():
+                # only the baseline session goes to the worker, not the whole rep table
+                baseline_df = rep_df[(athletes == athlete) & (rep_df['SessionNumber'] == baseline_session)]
+                if baseline_df.empty:
+                    registry.skipped.append((athlete, int(baseline_session), "no reps in the baseline session"))
+                    continue
+                jobs.append((baseline_df, athlete, int(baseline_session), baseline['loads'], baseline['one_rep_max'],
+                             profile_cache_file(cache_folder, athlete, baseline_session)))
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(fit_profile, *job): job for job in jobs}
+                for future in as_completed(futures):
+                    registry.add_fitted(futures[future], future.result)
+        else:
+            for job in jobs:
+                registry.add_fitted(job, lambda: fit_profile(*job))
+        return registry
+
+    def add_fitted(self, job, fitted):
+        '''
+        Adds the profile fitted for the job, a baseline whose sets do not match its loads is skipped and reported
+        '''
+        try:
+            self.add(ModelAnalysis.from_cache_data(fitted()))
+        except ValueError as error:
+            _, athlete, baseline_session = job[:3]
+            self.skipped.append((athlete, baseline_session, str(error)))
+
+    def profile(self, athlete, session):
+        '''
+        Returns the profile of the athlete's latest baseline at or before the session, None when there is none
+        '''
+        sessions = self.sessions.get(athlete)
+        if not sessions:
+            return None
+        index = bisect.bisect_right(sessions, session) - 1
+        if index < 0:
+            return None
+        return self.profiles[(athlete, sessions[index])]
+
+    def analyze_rep_table(self, rep_df, speed_column='Speed', intervals=None, level=0.95, **interval_options):
+        '''
+        Returns a copy of the rep table with the Predicted RIR, Predicted Percentage and Predicted Weight columns
+        of each athlete's profile added. BaselineSession is the baseline each row was predicted with, -1 (and no
+        predictions) for rows of unknown athletes or sessions before the athlete's first baseline.
+        intervals ('analytic' or 'bootstrap') adds the lower and upper bounds of each prediction as well
+        '''
+        speeds = rep_df[speed_column].to_numpy(dtype=float)
+        session_numbers = rep_df['SessionNumber'].to_numpy()
+        baseline_sessions = np.full(len(rep_df), -1)
+        predicted_rirs = np.full(len(rep_df), np.nan)
+        predicted_percentages = np.full(len(rep_df), np.nan)
+        predicted_weights = np.full(len(rep_df), np.nan)
+        interval_columns = {}
+
+        for athlete, rows in athlete_column(rep_df).groupby(athlete_column(rep_df), sort=False).indices.items():
+            sessions = np.array(self.sessions.get(athlete, []))
+            if len(sessions) == 0:
+                continue
+            # the baseline in force for each row, one searchsorted for all of the athlete's rows
+            profile_index = np.searchsorted(sessions, session_numbers[rows], side='right') - 1
+            for index in np.unique(profile_index[profile_index >= 0]):
+                selected = rows[profile_index == index]
+                profile = self.profiles[(athlete, int(sessions[index]))]
+                _, rirs, percentages, weights = profile.predict_batch(speeds[selected])
+                baseline_sessions[selected] = sessions[index]
+                predicted_rirs[selected] = rirs
+                predicted_percentages[selected] = percentages
+                predicted_weights[selected] = weights
+                if intervals is not None:
+                    for column, values in profile.interval_columns(speeds[selected], intervals, level, **interval_options).items():
+                        interval_columns.setdefault(column, np.full(len(rep_df), np.nan))[selected] = values
+
+        return rep_df.assign(**{
+            'BaselineSession': baseline_sessions,
+            'Predicted RIR': predicted_rirs,
+            'Predicted Percentage': predicted_percentages,
+            'Predicted Weight': predicted_weights,
+        }, **interval_columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a profile per athlete and baseline session and analyse a rep table")
+    parser.add_argument('--rep-table', default='rep_table.npz', help="rep table to fit and analyse")
+    parser.add_argument('--baselines', default=None, help="baselines json file, by default session 0 of every athlete")
+    parser.add_argument('--workers', type=int, default=1, help="processes to fit the profiles with")
+    parser.add_argument('--cache', default='model_cache', help="folder of the profile caches")
+    parser.add_argument('--no-cache', action='store_true', help="always fit the profiles")
+    parser.add_argument('--intervals', choices=['analytic', 'bootstrap'], default=None, help="add prediction interval columns")
+    parser.add_argument('--output', default='rep_analysis.npz', help="analysed rep table (a csv copy is written too)")
+    args = parser.parse_args()
+
+    rep_df = load_rep_table(args.rep_table)
+    baselines = load_baselines(args.baselines) if args.baselines is not None else None
+    registry = ModelRegistry.build(rep_df, baselines, workers=args.workers,
+                                   cache_folder=None if args.no_cache else args.cache)
+    for athlete, sessions in registry.sessions.items():
+        print(f"{athlete}: baseline sessions {sessions}")
+    for athlete, baseline_session, reason in registry.skipped:
+        print(f"{athlete}: baseline session {baseline_session} skipped, {reason}")
+    save_table(registry.analyze_rep_table(rep_df, intervals=args.intervals), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+'''
+This script updates an athlete's load velocity profile as new reps arrive, without fitting it again from scratch.
+
+Each of the three linear models only needs six running sums (weight, x, y, x², xy, y²) to give its least squares
+coefficients, so a new observation is O(1) work however long the history is. With a forgetting factor below 1 the
+sums of the older observations shrink by that factor on every update (exponentially weighted least squares), so the
+profile follows changes in fitness without reprocessing the history.
+
+An OnlineProfile is a ModelAnalysis, it is seeded from a fitted profile and has the same prediction methods
+(predict_batch, analyze_rep_table, analyze_new_speeds etc.).
+'''
+
+import json
+import numpy as np
+from create_models.model_analysis import ModelAnalysis, MODELS
+
+# positions of the running sums in each model's statistics
+WEIGHT, SUM_X, SUM_Y, SUM_XX, SUM_XY, SUM_YY = range(6)
+
+
+def observation_sums(x, y, weights):
+    return np.array([np.sum(weights), np.sum(weights * x), np.sum(weights * y),
+                     np.sum(weights * x * x), np.sum(weights * x * y), np.sum(weights * y * y)])
+
+
+class OnlineProfile(ModelAnalysis):
+    def __init__(self, forgetting=1.0):
+        # only the prediction side of ModelAnalysis is used, there is no rep table or statsmodels fit
+        self.csv_file = None
+        self.cache_file = None
+        self.athlete = None
+        self.baseline_session = None
+        self.video_df = None
+        self.day_0_results = None
+        self.model_s_vs_percentage = None
+        self.model_s_vs_rir = None
+        self.model_rir_vs_percentage = None
+        self.forgetting = forgetting # 1.0 keeps every observation, e.g. 0.95 halves an observation's weight in ~14 updates
+        self.statistics = {name: np.zeros(6) for name in MODELS}
+        self.coefficients = {}
+        self.diagnostics = {}
+
+    @classmethod
+    def from_analysis(cls, analysis, forgetting=1.0):
+        '''
+        Starts from the training data of a fitted (or cached) ModelAnalysis
+        '''
+        profile = cls(forgetting)
+        profile.athlete = analysis.athlete
+        profile.baseline_session = analysis.baseline_session
+        profile.update_batch(analysis.original_speeds, analysis.rirs, analysis.percentages)
+        return profile
+
+    def update(self, speed, rir=None, percentage=None):
+        '''
+        Adds one observation, the models of a missing rir or percentage are left as they are
+        '''
+        values = {'original_speeds': speed, 'rirs': rir, 'percentages': percentage}
+        for name, (x_name, y_name) in MODELS.items():
+            x, y = values[x_name], values[y_name]
+            if x is None or y is None:
+                continue
+            self.statistics[name] = self.forgetting * self.statistics[name] + np.array([1.0, x, y, x * x, x * y, y * y])
+            self.refresh(name)
+
+    def update_batch(self, speeds, rirs=None, percentages=None):
+        '''
+        Same as calling update for each observation in order, in one vectorised step per model
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        values = {'original_speeds': speeds,
+                  'rirs': None if rirs is None else np.asarray(rirs, dtype=float),
+                  'percentages': None if percentages is None else np.asarray(percentages, dtype=float)}
+        # the i-th of n observations has been forgotten n - 1 - i times by the end of the batch
+        ages = np.arange(len(speeds) - 1, -1, -1)
+        weights = self.forgetting ** ages
+        for name, (x_name, y_name) in MODELS.items():
+            x, y = values[x_name], values[y_name]
+            if x is None or y is None:
+                continue
+            self.statistics[name] = (self.forgetting ** len(speeds)) * self.statistics[name] + observation_sums(x, y, weights)
+            self.refresh(name)
+
+    def refresh(self, name):
+        '''
+        Coefficients and diagnostics of a model from its running sums
+        '''
+        weight, sum_x, sum_y, sum_xx, sum_xy, sum_yy = self.statistics[name]
+        if weight <= 0:
+            return
+        x_mean = sum_x / weight
+        y_mean = sum_y / weight
+        sxx = sum_xx - sum_x * x_mean
+        sxy = sum_xy - sum_x * y_mean
+        syy = sum_yy - sum_y * y_mean
+        if sxx <= 0:
+            # every x value so far is the same, there is no slope to fit yet
+            return
+
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        self.coefficients[name] = (float(intercept), float(slope))
+
+        residual_ss = max(syy - slope * sxy, 0.0)
+        df_resid = weight - 2
+        mse_resid = residual_ss / df_resid if df_resid > 0 else float('nan')
+        self.diagnostics[name] = {
+            'r_squared': float(1 - residual_ss / syy) if syy > 0 else float('nan'),
+            'std_errors': [float(np.sqrt(mse_resid * (1 / weight + x_mean ** 2 / sxx))), float(np.sqrt(mse_resid / sxx))],
+            'nobs': float(weight), # effective number of observations when older ones are forgotten
+            'df_resid': float(df_resid),
+            'mse_resid': float(mse_resid),
+            'x_mean': float(x_mean),
+            'sxx': float(sxx),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'athlete': self.athlete,
+                       'baseline_session': self.baseline_session,
+                       'forgetting': self.forgetting,
+                       'statistics': {name: stats.tolist() for name, stats in self.statistics.items()}}, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        profile = cls(state['forgetting'])
+        profile.athlete = state['athlete']
+        profile.baseline_session = state['baseline_session']
+        for name, stats in state['statistics'].items():
+            profile.statistics[name] = np.array(stats)
+            profile.refresh(name)
+        return profile
@@ -1,59 +1,182 @@
-import cv2
-import os
-
-# Directory containing the videos
-video_directory = './videos/unedited'
-
-# Desired resolution
-new_width = 1280
-new_height = 720
-
-# Iterate over each video file in the directory
-for filename in os.listdir(video_directory):
-    # Check if the file is a video (for simplicity, checking by extension)
-    if filename.lower().endswith(('.mov', '.webm', '.avi')):  # Add or remove extensions as needed
-        input_video_path = os.path.join(video_directory, filename)
-        output_video_path = os.path.join(video_directory, os.path.splitext(filename)[0] + 'E.MOV')
-
-        # Capture the input video
-        cap = cv2.VideoCapture(input_video_path)
-
-        # Get the original video's frame rate
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        print(f"Original FPS: {fps} for {filename}")  # Verify the detected frame rateR
-
-        # Calculate the number of frames to skip (13 seconds)
-        frames_to_skip = int(fps * 1)
-
-        # Define the codec and create a VideoWriter object to write the video
-        fourcc = cv2.VideoWriter_fourcc(*'avc1')
-        out = cv2.VideoWriter(output_video_path, fourcc, fps, (new_width, new_height))
-
-        # Initialize a counter for frames processed
-        frame_count = 0
-
-        while True:
-            # Read frame-by-frame
-            ret, frame = cap.read()
-
-            if not ret:
-                break  # Break the loop if there are no frames left
-
-            # Increment frame count
-            frame_count += 1
-
-            # Skip the first 13 seconds of frames
-            if frame_count <= frames_to_skip:
-                continue
-
-            # Resize the frame
-            resized_frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-            # Write the resized frame to the output video
-            out.write(resized_frame)
-
-        # Release everything when the job is finished
-        cap.release()
-        out.release()
-
-        print(f"Processed {filename}")
+'''
+This script pre-processes the raw videos, it trims each video down to the set and resizes it to 720p.
+
+Rather than dropping a fixed second at the start, each video is probed for the set: frames are only grabbed (not
+converted) and every --probe-step seconds one is shrunk to a thumbnail and checked for the light-blue bar marker
+(falling back to plain motion when no marker is seen). At the first movement the capture seeks back --pad seconds, so
+the bar is still racked at the start of the trimmed video, and from there frames are resized and encoded until the
+bar is back in the rack and has not moved for --idle seconds. Back in the rack means the bar was walked out sideways
+from where it stood before the set and then walked back there, so a rest at lockout in the middle of a set does not
+end it. Nothing after the set is decoded at all. Without the bar marker the rack can not be told apart from a rest,
+the video is then kept to the end.
+
+Seeking to every probe frame instead was tried, OpenCV decodes forward from a keyframe on every seek which made
+the probe slower than grabbing the frames in order.
+
+Videos are processed in parallel worker processes (--workers, defaults to the number of cores).
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+
+VIDEO_EXTENSIONS = ('.mov', '.webm', '.avi')  # Add or remove extensions as needed
+
+# light-blue range of the bar marker, as used by the tracker
+LOWER_BLUE = np.array([90, 120, 120])
+UPPER_BLUE = np.array([100, 255, 255])
+
+
+class ActivityProbe:
+    '''
+    Tells whether the bar (or, when the bar marker is not in view, anything) moved since the previous probed frame,
+    working on a probe_width wide thumbnail only
+    '''
+    def __init__(self, probe_width=160, bar_move_px=1.0, motion_level=4.0):
+        self.probe_width = probe_width
+        self.bar_move_px = bar_move_px # bar centre movement between probes, in thumbnail pixels
+        self.motion_level = motion_level # mean grey level change between probes when there is no bar marker
+        self.previous_grey = None
+        self.previous_centre = None
+        self.half_width = None # half the width of the bar marker on the last thumbnail it was seen on
+
+    def moved(self, frame):
+        height, width = frame.shape[:2]
+        thumbnail = cv2.resize(frame, (self.probe_width, max(int(height * self.probe_width / width), 1)),
+                               interpolation=cv2.INTER_AREA)
+        mask = cv2.inRange(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2HSV), LOWER_BLUE, UPPER_BLUE)
+        ys, xs = np.nonzero(mask)
+        centre = (xs.mean(), ys.mean()) if len(xs) else None
+        if len(xs):
+            self.half_width = (xs.max() - xs.min() + 1) / 2
+        grey = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+
+        moved = False
+        if centre is not None and self.previous_centre is not None:
+            moved = np.hypot(centre[0] - self.previous_centre[0], centre[1] - self.previous_centre[1]) > self.bar_move_px
+        elif self.previous_grey is not None:
+            moved = cv2.absdiff(grey, self.previous_grey).mean() > self.motion_level
+
+        self.previous_centre, self.previous_grey = centre, grey
+        return moved
+
+
+def find_set_start(cap, fps, probe_step_s=0.5):
+    '''
+    Seconds of the last probe before the first movement, None when nothing moves in the whole video, and the probe
+    holding the rack position (the bar centre before the movement, None without the bar marker).
+    Only the probed frames are retrieved, the others are just grabbed.
+    '''
+    step = max(int(round(probe_step_s * fps)), 1)
+    probe = ActivityProbe()
+    frame_index = 0
+    while cap.grab():
+        if frame_index % step == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                rack = probe.previous_centre
+                if probe.moved(frame):
+                    return max(frame_index - step, 0) / fps, rack, probe.half_width
+        frame_index += 1
+    return None, None, None
+
+
+def open_writer(output_path, fps, size):
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'avc1'), fps, size)
+    if not writer.isOpened():
+        # not every OpenCV build has an avc1 encoder
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    return writer
+
+
+def resize_video(input_video_path, output_video_path, size=(1280, 720), probe=True, skip_s=1.0, pad_s=1.0,
+                 idle_s=3.0, probe_step_s=0.5):
+    '''
+    Trims and resizes one video, returns (filename, start, end, frames written).
+    Without the probe the first skip_s seconds are dropped and the rest is kept, as before.
+    '''
+    cap = cv2.VideoCapture(input_video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    set_start_s, rack, rack_half_width = find_set_start(cap, fps, probe_step_s) if probe else (None, None, None)
+    if set_start_s is not None:
+        start_s = max(set_start_s - pad_s, 0.0)
+    else:
+        # no probe, or nothing moved so the whole video is kept
+        start_s = skip_s if not probe else 0.0
+        probe = False
+
+    # seek straight to the segment instead of decoding and discarding the frames before it
+    cap.set(cv2.CAP_PROP_POS_MSEC, start_s * 1000)
+    out = open_writer(output_video_path, fps, size)
+    step = max(int(round(probe_step_s * fps)), 1)
+    end_probe = ActivityProbe()
+    last_movement_s = set_start_s
+    walked_out = False # the bar has left the rack sideways since the set started
+    frames_written = 0
+    time_s = start_s
+    raw_frame = None
+    resized_frame = None
+    while True:
+        ret, raw_frame = cap.read(raw_frame)
+        if not ret:
+            break
+        time_s = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        resized_frame = cv2.resize(raw_frame, size, dst=resized_frame, interpolation=cv2.INTER_AREA)
+        out.write(resized_frame)
+
+        if probe and rack is not None and frames_written % step == 0:
+            if end_probe.moved(resized_frame):
+                last_movement_s = time_s
+            centre = end_probe.previous_centre
+            in_rack = centre is not None and abs(centre[0] - rack[0]) <= rack_half_width
+            walked_out = walked_out or (centre is not None and not in_rack)
+            if walked_out and in_rack and time_s - last_movement_s > idle_s:
+                # the bar is back in the rack, the rest of the video is not even decoded
+                break
+        frames_written += 1
+
+    # Release everything when the job is finished
+    cap.release()
+    out.release()
+    return os.path.basename(input_video_path), start_s, time_s, frames_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trim every raw video to its set and resize it to 720p")
+    parser.add_argument('--videos', default='./videos/unedited', help="folder of the raw videos")
+    parser.add_argument('--output-folder', default=None, help="folder of the trimmed videos, the raw video folder by default")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, defaults to the number of cores")
+    parser.add_argument('--size', default='1280x720', metavar='WIDTHxHEIGHT', help="resolution of the trimmed videos")
+    parser.add_argument('--no-probe', action='store_true', help="do not look for the set, only drop the first --skip-s seconds")
+    parser.add_argument('--skip-s', type=float, default=1.0, help="seconds dropped at the start without the probe")
+    parser.add_argument('--pad', type=float, default=1.0, help="seconds kept before the first movement found by the probe")
+    parser.add_argument('--idle', type=float, default=3.0, help="seconds the bar stands still back in the rack that end the set")
+    parser.add_argument('--probe-step', type=float, default=0.5, help="seconds between the probed frames")
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    output_folder = args.output_folder or args.videos
+    os.makedirs(output_folder, exist_ok=True)
+
+    jobs = []
+    for filename in sorted(os.listdir(args.videos)):
+        # Check if the file is a video (for simplicity, checking by extension)
+        # files ending in E are the outputs of an earlier run when they are written next to the raw videos
+        if filename.lower().endswith(VIDEO_EXTENSIONS) and not os.path.splitext(filename)[0].endswith('E'):
+            output_video_path = os.path.join(output_folder, os.path.splitext(filename)[0] + 'E.MOV')
+            jobs.append((os.path.join(args.videos, filename), output_video_path))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(resize_video, input_path, output_path, size, not args.no_probe, args.skip_s,
+                                   args.pad, args.idle, args.probe_step)
+                   for input_path, output_path in jobs]
+        for future in as_completed(futures):
+            filename, start_s, end_s, frames_written = future.result()
+            print(f"Processed {filename}: {start_s:.1f}s - {end_s:.1f}s, {frames_written} frames")
+
+
+if __name__ == "__main__":
+    main()